@@ -0,0 +1,143 @@
+""" Generates a deterministic corpus of synthetic VSO and AO dossiers as txt, text-layer pdf, scanned pdf and docx """
+import random
+import zipfile
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+FORMATS = ['txt', 'pdf', 'scanned.pdf', 'docx']
+LINES_PER_PAGE = 45
+FILLER_WORDS = ['werkgever', 'werknemer', 'partijen', 'overeenkomst', 'bepaling', 'artikel', 'bijlage', 'regeling',
+                'voorwaarden', 'verplichting', 'toepassing', 'datum', 'vergoeding', 'afspraken', 'schriftelijk']
+
+
+def filler(rnd: random.Random, articles: int, first_number: int) -> list[str]:
+    lines = []
+    for number in range(first_number, first_number + articles):
+        lines += ['', f'Artikel {number}']
+        for _ in range(rnd.randint(3, 8)):
+            lines += [' '.join(rnd.choice(FILLER_WORDS) for _ in range(12)).capitalize() + '.']
+    return lines
+
+
+def vso_lines(rnd: random.Random, number: int) -> list[str]:
+    lines = ['VASTSTELLINGSOVEREENKOMST', '',
+             f'De ondergetekenden: Werkgever {number} B.V., gevestigd aan de Stationsstraat {number} te Utrecht,',
+             f'en de heer Jansen {number}, wonende aan de Dorpsweg {rnd.randint(1, 200)} te Zeist,', '',
+             'Artikel 1', 'Werkgever heeft voorgesteld de arbeidsovereenkomst te beëindigen wegens een reorganisatie.',
+             'Werknemer kan geen verwijt worden gemaakt en er is geen dringende reden. Er geldt geen opzegverbod.',
+             'Artikel 2', 'De beëindiging van de arbeidsovereenkomst geschiedt met wederzijds goedvinden '
+             f'per {rnd.randint(1, 28)} {rnd.choice(["maart", "juni", "september"])} 2024.',
+             'Artikel 3', f'Het salaris bedraagt EUR {rnd.randint(3000, 7000)} bruto per maand. '
+             'Werkgever maakt uiterlijk een maand na de einddatum een eindafrekening.',
+             'Artikel 4', 'Het relatiebeding en het concurrentiebeding komen te vervallen. '
+             'De pensioenregeling wordt tot de einddatum voortgezet.',
+             'Artikel 5', 'Werknemer heeft een bedenktijd van veertien dagen na ondertekening.']
+    lines += filler(rnd, rnd.randint(2, 30), 6)
+    lines += ['', f'Aldus overeengekomen en ondertekend te Utrecht op {rnd.randint(1, 28)} januari 2024.']
+    return lines
+
+
+def ao_lines(rnd: random.Random, number: int) -> list[str]:
+    lines = ['ARBEIDSOVEREENKOMST', '',
+             f'De ondergetekenden: Werkgever {number} B.V. en de heer Jansen {number}.', '',
+             'Artikel 1', f'Werknemer treedt in dienst op {rnd.randint(1, 28)} mei {rnd.randint(2000, 2020)} '
+             'in de functie van adviseur, voor onbepaalde tijd.',
+             'Artikel 2', 'De proeftijd bedraagt 30 dagen. De opzegtermijn bedraagt een maand.',
+             'Artikel 3', f'Het salaris bedraagt EUR {rnd.randint(3000, 7000)} bruto per maand. '
+             f'Werknemer heeft recht op {rnd.randint(20, 30)} vakantiedagen per jaar.',
+             'Artikel 4', 'Werknemer neemt deel aan de pensioenregeling van werkgever.',
+             'Artikel 5', 'Er geldt een relatiebeding en een concurrentiebeding voor de duur van een jaar.']
+    lines += filler(rnd, rnd.randint(2, 30), 6)
+    lines += ['', 'Aldus overeengekomen en ondertekend te Utrecht.']
+    return lines
+
+
+def write_txt(path: Path, lines: list[str]):
+    path.write_text('\n'.join(lines) + '\n')
+
+
+def pdf_string(line: str) -> bytes:
+    return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').encode('cp1252', 'replace')
+
+
+def write_text_pdf(path: Path, lines: list[str]):
+    """ Minimal pdf with a Helvetica text layer, enough for pypdf to extract """
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)]
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>']
+    page_ids = []
+    for page in pages:
+        content = b'BT /F1 10 Tf 14 TL 50 800 Td ' + b''.join(b'(' + pdf_string(line) + b') Tj T* ' for line in page)
+        content += b'ET'
+        objects += [b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream']
+        objects += [b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> '
+                    b'/Contents %d 0 R >>' % len(objects)]
+        page_ids += [len(objects)]
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % i for i in page_ids),
+                                                                len(page_ids))
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets += [len(data)]
+        data += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    data += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    path.write_bytes(data)
+
+
+def write_scanned_pdf(path: Path, lines: list[str], dpi=200):
+    """ Image-only pdf: the text is drawn on A4 pages so it can only be read with OCR """
+    from PIL import Image, ImageDraw, ImageFont
+
+    try:
+        font = ImageFont.load_default(size=dpi // 7)
+    except TypeError:  # Pillow < 10.1 has no scalable default font
+        font = ImageFont.load_default()
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    images = []
+    for i in range(0, len(lines), LINES_PER_PAGE):
+        image = Image.new('L', (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        for n, line in enumerate(lines[i:i + LINES_PER_PAGE]):
+            draw.text((dpi // 2, dpi // 2 + n * dpi // 5), line, fill=0, font=font)
+        images += [image]
+    images[0].save(path, 'PDF', resolution=dpi, save_all=True, append_images=images[1:])
+
+
+def write_docx(path: Path, lines: list[str]):
+    paragraphs = ''.join(f'<w:p><w:r><w:t xml:space="preserve">{escape(line)}</w:t></w:r></w:p>' for line in lines)
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{paragraphs}</w:body></w:document>')
+    content_types = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                     '<Default Extension="xml" ContentType="application/xml"/>'
+                     '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-'
+                     'officedocument.wordprocessingml.document.main+xml"/></Types>')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', content_types)
+        z.writestr('word/document.xml', document)
+
+
+WRITERS = {'txt': write_txt, 'pdf': write_text_pdf, 'scanned.pdf': write_scanned_pdf, 'docx': write_docx}
+
+
+def generate_corpus(directory, dossiers: int, formats: list[str] = None, seed: int = 42) -> list[list[Path]]:
+    """ Writes dossiers VSO/AO pairs to directory, cycling through formats.
+    Returns per dossier the paths of its documents, the VSO first """
+    formats = formats or FORMATS
+    rnd = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    result = []
+    for number in range(dossiers):
+        paths = []
+        for kind, lines in (('vso', vso_lines(rnd, number)), ('ao', ao_lines(rnd, number))):
+            file_format = formats[(2 * number + len(paths)) % len(formats)]
+            path = directory / f'{number:05d}_{kind}.{file_format}'
+            WRITERS[file_format](path, lines)
+            paths += [path]
+        result += [paths]
+    return result
@@ -0,0 +1,54 @@
+""" Guard against import time regressions.
+
+Every statement is timed in a fresh interpreter. The run fails (exit code 1) when a statement loads one of the
+heavy dependencies it should not need, or when its median time exceeds the budget.
+Usage (from the repository root):
+    python -m benchmarks.import_time --runs 5 """
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ['openai', 'justai', 'gpteasy', 'numpy', 'cv2', 'pdf2image', 'pytesseract', 'tesserocr', 'PIL',
+                 'pypdf', 'docx2txt']
+# Statement -> budget in milliseconds. Analyzing text needs no document reader, reading documents no LLM client
+STATEMENTS = {'import otis_ask': 50,
+              'from otis_ask import analyze_vso, analyze_many_async': 300,
+              'from otis_ask import read_file': 150}
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{'ms': seconds * 1000, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def measure(statement: str) -> dict:
+    code = CHILD.format(statement=statement, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of otis_ask')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per statement, the median counts')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply the budgets, for slow machines')
+    args = parser.parse_args()
+
+    failed = False
+    print(f'{"statement":56} {"median ms":>10} {"budget":>8}  heavy modules loaded')
+    for statement, budget in STATEMENTS.items():
+        results = [measure(statement) for _ in range(args.runs)]
+        median = statistics.median(result['ms'] for result in results)
+        heavy = sorted(set().union(*(result['heavy'] for result in results)))
+        over = median > budget * args.scale
+        failed |= over or bool(heavy)
+        print(f'{statement:56} {median:10.1f} {budget * args.scale:8.0f}  {", ".join(heavy) or "-"}'
+              f'{"  FAIL" if over or heavy else ""}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
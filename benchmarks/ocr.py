@@ -0,0 +1,48 @@
+""" Benchmark of the OCR engines: pages per second of pytesseract (a tesseract process per page) against tesserocr
+(an engine kept in memory). Pages are rendered once up front, so only the OCR itself is timed, in a single thread.
+Needs poppler and tesseract, tesserocr is skipped when it is not installed.
+
+Usage (from the repository root):
+    python -m benchmarks.ocr --pages 10 """
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.corpus import LINES_PER_PAGE, filler, vso_lines, write_scanned_pdf
+from otis_ask import documentreader
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the OCR engines')
+    parser.add_argument('--pages', type=int, default=10, help='Number of scanned pages to OCR per engine')
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    lines = vso_lines(rnd, 0)
+    lines += filler(rnd, args.pages * LINES_PER_PAGE // 6, 100)  # Articles have about 6 lines
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'scanned.pdf'
+        write_scanned_pdf(path, lines[:args.pages * LINES_PER_PAGE])
+        images = [documentreader.render_page(str(path), page) for page in range(1, args.pages + 1)]
+
+    engines = ['pytesseract'] + (['tesserocr'] if documentreader.tesserocr_module() is not None else [])
+    texts = {}
+    print(f'{"engine":12} {"pages/s":>8} {"ms/page":>8}')
+    for engine in engines:
+        documentreader.OCR_ENGINE = engine
+        documentreader.image_to_string(images[0])  # Warm up, tesserocr loads the language data here
+        start = time.perf_counter()
+        texts[engine] = [documentreader.image_to_string(image) for image in images]
+        seconds = time.perf_counter() - start
+        print(f'{engine:12} {len(images) / seconds:8.2f} {seconds / len(images) * 1000:8.0f}')
+    if len(texts) == 2:
+        same = sum(a.split() == b.split() for a, b in zip(*texts.values()))
+        print(f'{same} of {len(images)} pages have the same words with both engines')
+    else:
+        print('tesserocr is not installed, pip install tesserocr to compare')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+""" Offline end-to-end benchmark of the analysis pipeline.
+
+The LLM is replaced by StubAgent and all caches are disabled, so runs are deterministic and need no network.
+Usage (from the repository root):
+    python -m benchmarks.run --dossiers 20 --latency 0.05 --output bench.json
+    python -m benchmarks.run --compare bench.json
+Scanned pdfs are only included when poppler and tesseract are installed. """
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from importlib import metadata
+from pathlib import Path
+
+from benchmarks.corpus import FORMATS, generate_corpus
+from benchmarks.stub_llm import StubAgent
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    index = (len(values) - 1) * p
+    low = int(index)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (index - low)
+
+
+def summarize(durations: list[float]) -> dict:
+    total = sum(durations)
+    return {'count': len(durations),
+            'throughput_per_s': len(durations) / total if total else 0.0,
+            'mean_ms': statistics.fmean(durations) * 1000,
+            'p50_ms': percentile(durations, 0.5) * 1000,
+            'p95_ms': percentile(durations, 0.95) * 1000}
+
+
+def available_formats() -> list[str]:
+    if shutil.which('pdftoppm') and shutil.which('tesseract'):
+        return FORMATS
+    return [file_format for file_format in FORMATS if file_format != 'scanned.pdf']
+
+
+def run(dossiers: int, latency: float, formats: list[str]) -> dict:
+    from otis_ask import analysis
+    from otis_ask.analysis import analyze_document, check_document_type, check_vso_with_ao, process_response
+    from otis_ask.checks import Checks
+    from otis_ask.clients import agent_pool
+    from otis_ask.documentreader import read_file
+    from otis_ask.prompting import create_prompt
+
+    StubAgent.latency = latency
+    agent_pool.factory = StubAgent
+    analysis.response_cache.path = None
+    analysis.check_cache.path = None
+
+    timings = defaultdict(list)
+
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] += [time.perf_counter() - start]
+        return result
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = generate_corpus(directory, dossiers, formats)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for paths in corpus:
+                dossier_start = time.perf_counter()
+                checks = {}
+                for path in paths:
+                    file_format = path.name.split('.', 1)[1]
+                    text = timed(f'read_file[{file_format}]', read_file, str(path), use_cache=False)
+                    document_type = timed('check_document_type', check_document_type, text)
+                    kind = {'vaststellingsovereenkomst': 'vso', 'arbeidsovereenkomst': 'ao'}.get(document_type)
+                    if not kind:
+                        continue
+                    checks[kind] = timed('analyze_document', analyze_document, kind, text,
+                                         Checks('vso_checks.toml'), Checks('ao_checks.toml'))
+
+                    # process_response on its own, on the answer the stub gives for the full check set
+                    fresh_checks = Checks(f'{kind}_checks.toml')
+                    response = StubAgent.answer(create_prompt(text, fresh_checks))
+                    timed('process_response', process_response, response, fresh_checks)
+                if 'vso' in checks and 'ao' in checks:
+                    timed('check_vso_with_ao', check_vso_with_ao, checks['vso'], checks['ao'])
+                timings['pipeline_per_dossier'] += [time.perf_counter() - dossier_start]
+        wall = time.perf_counter() - start
+
+    try:
+        version = metadata.version('otis_ask')
+    except metadata.PackageNotFoundError:
+        version = 'unknown'
+    return {'otis_ask_version': version,
+            'python': platform.python_version(),
+            'settings': {'dossiers': dossiers, 'latency_s': latency, 'formats': formats},
+            'wall_seconds': wall,
+            'dossiers_per_s': dossiers / wall if wall else 0.0,
+            'stages': {stage: summarize(durations) for stage, durations in sorted(timings.items())}}
+
+
+def compare(baseline: dict, current: dict):
+    print(f'{"stage":32} {"p50 ms":>10} {"was":>10} {"p95 ms":>10} {"was":>10} {"change p50":>11}')
+    for stage, stats in current['stages'].items():
+        old = baseline['stages'].get(stage)
+        if not old:
+            print(f'{stage:32} {stats["p50_ms"]:10.2f} {"-":>10} {stats["p95_ms"]:10.2f} {"-":>10}')
+            continue
+        change = (stats['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0.0
+        print(f'{stage:32} {stats["p50_ms"]:10.2f} {old["p50_ms"]:10.2f} {stats["p95_ms"]:10.2f} '
+              f'{old["p95_ms"]:10.2f} {change:+10.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the otis_ask pipeline')
+    parser.add_argument('--dossiers', type=int, default=20, help='Number of VSO/AO pairs to generate')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per stub LLM call')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, help='Document formats, default all available')
+    parser.add_argument('--output', help='Write the results as json to this file')
+    parser.add_argument('--compare', help='Compare the results with an earlier json output')
+    args = parser.parse_args()
+
+    result = run(args.dossiers, args.latency, args.formats or available_formats())
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), result)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
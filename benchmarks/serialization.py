@@ -0,0 +1,81 @@
+""" Benchmark of storing and reloading analysis results: per-object json against otis_ask.serialization.
+
+Usage (from the repository root):
+    python -m benchmarks.serialization --dossiers 2000 """
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+from justai import set_prompt_file
+
+from benchmarks.stub_llm import StubAgent
+from otis_ask.analysis import process_response
+from otis_ask.checks import Checks
+from otis_ask.prompting import create_prompt
+from otis_ask.serialization import dumps, loads
+
+
+def answered_checks(dossiers: int, seed: int = 42) -> list[Checks]:
+    """ VSO and AO check sets filled with the stub LLM answers, with some values blanked to vary the results """
+    set_prompt_file(Path(__file__).absolute().parent.parent / 'otis_ask' / 'prompts.toml')
+    rnd = random.Random(seed)
+    answers = {}
+    results = []
+    for number in range(dossiers):
+        for kind in ('vso', 'ao'):
+            checks = Checks(f'{kind}_checks.toml')
+            if kind not in answers:
+                answers[kind] = StubAgent.answer(create_prompt('', checks)).splitlines()
+            lines = [line if rnd.random() > 0.2 else line.split(' ', 1)[0] for line in answers[kind]]
+            process_response('\n'.join(lines), checks)
+            results += [checks]
+    return results
+
+
+def timed(func, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def json_dumps(results: list[Checks]) -> list[str]:
+    return [json.dumps(checks.serializable()) for checks in results]
+
+
+def json_loads(encoded: list[str]) -> list[Checks]:
+    results = []
+    for json_str in encoded:
+        checks = Checks()
+        checks.deserialize(json_str)
+        results += [checks]
+    return results
+
+
+def same(a: list[Checks], b: list[Checks]) -> bool:
+    return all(x.checks == y.checks and all(type(c.value) is type(d.value) and c.check_type is d.check_type
+                                            for c, d in zip(x, y)) for x, y in zip(a, b)) and len(a) == len(b)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark serialization of Checks results')
+    parser.add_argument('--dossiers', type=int, default=2000, help='Number of VSO/AO result pairs')
+    args = parser.parse_args()
+
+    results = answered_checks(args.dossiers)
+    json_encode, json_encoded = timed(json_dumps, results)
+    json_decode, json_results = timed(json_loads, json_encoded)
+    encode, encoded = timed(dumps, results)
+    decode, decoded = timed(loads, encoded)
+
+    print(f'{len(results)} check sets, {sum(map(len, results))} checks')
+    print(f'{"":10} {"encode ms":>10} {"decode ms":>10} {"bytes":>12} {"exact":>6}')
+    print(f'{"json":10} {json_encode * 1000:10.1f} {json_decode * 1000:10.1f} '
+          f'{sum(len(s.encode()) for s in json_encoded):12} {str(same(results, json_results)):>6}')
+    print(f'{"columnar":10} {encode * 1000:10.1f} {decode * 1000:10.1f} {len(encoded):12} '
+          f'{str(same(results, decoded)):>6}')
+
+
+if __name__ == '__main__':
+    main()
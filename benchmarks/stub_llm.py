@@ -0,0 +1,71 @@
+""" Deterministic local stand-in for the LLM. It answers the CHECK_DOCUMENT_TYPE, ANALYZE_DOCUMENT and
+CLASSIFY_AND_ANALYZE prompts in the format the real model uses, after sleeping for a configurable latency. """
+import hashlib
+import re
+import time
+
+CHECK_LINE = re.compile(r'^(\d+) (.*?)(?: \(antwoord met (.*)\))?;$', re.MULTILINE)
+DATE_FIELDS = re.compile(r'Bij (.*?) extraheer de datum')
+
+
+class StubAgent:
+    latency = 0.05  # Seconds per call, set it on the class to change it for all agents in the pool
+
+    def __init__(self, model: str):
+        self.model = model
+        self.temperature = 0
+        self.calls = 0
+
+    def reset(self):
+        pass
+
+    def chat(self, prompt: str) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.answer(prompt)
+
+    @staticmethod
+    def answer(prompt: str) -> str:
+        if 'Check eerst het type van het document' in prompt:  # CLASSIFY_AND_ANALYZE
+            document_type = StubAgent.document_type(prompt.split("'''")[1])
+            _, vso_part = prompt.split('Is het een vaststellingsovereenkomst, extraheer dan', 1)
+            vso_part, ao_part = vso_part.split('Is het een arbeidsovereenkomst, extraheer dan', 1)
+            ao_part = ao_part.split('Is het een ander type', 1)[0]
+            checks_part = {'vaststellingsovereenkomst': vso_part, 'arbeidsovereenkomst': ao_part}.get(document_type)
+            answers = StubAgent.answer_checks(checks_part) if checks_part else ''
+            return f'TYPE {document_type}\n{answers}'.strip()
+
+        if 'Check het type van het document' in prompt:  # The prompt itself mentions every type, only look at the text
+            return StubAgent.document_type(prompt.split("'''")[1])
+
+        checks_part = prompt.split('Extraheer de volgende zaken uit de tekst:', 1)[-1]
+        checks_part = checks_part.split('Antwoord in het volgende formaat:', 1)[0]
+        return StubAgent.answer_checks(checks_part)
+
+    @staticmethod
+    def document_type(text: str) -> str:
+        text = text.lower()
+        if 'vaststellingsovereenkomst' in text or 'beëindiging' in text:
+            return 'vaststellingsovereenkomst'
+        if 'arbeidsovereenkomst' in text:
+            return 'arbeidsovereenkomst'
+        return 'ander type'
+
+    @staticmethod
+    def answer_checks(checks_part: str) -> str:
+        date_fields = set()
+        for fields in DATE_FIELDS.findall(checks_part):
+            date_fields.update(re.findall(r'\d+', fields))
+
+        lines = []
+        for number, check_prompt, options in CHECK_LINE.findall(checks_part):
+            seed = int(hashlib.md5(check_prompt.encode()).hexdigest(), 16)
+            if number in date_fields:
+                value = f'{2015 + seed % 10}-{1 + seed % 12:02d}-{1 + seed % 28:02d}'
+            elif options:
+                first, *_ = re.split(r',| of ', options)
+                value = first.strip()
+            else:
+                value = f'waarde {seed % 1000}'
+            lines += [f'{number} {value}']
+        return '\n'.join(lines)
@@ -1,2 +1,24 @@
-from .analysis import analyze_vso, analyze_ao, check_document_type
-from .documentreader import read_file
\ No newline at end of file
+""" The public api is imported on first use, so `import otis_ask` does not load openai, OpenCV, numpy, pypdf and
+the other heavy dependencies until a function that needs them is called """
+import importlib
+
+_exports = {
+    'analyze_vso': 'analysis', 'analyze_ao': 'analysis', 'check_document_type': 'analysis',
+    'classify_document': 'analysis', 'classify_and_analyze': 'analysis',
+    'analyze_vso_async': 'analysis', 'analyze_ao_async': 'analysis', 'check_document_type_async': 'analysis',
+    'classify_document_async': 'analysis', 'analyze_many_async': 'analysis', 'classify_and_analyze_async': 'analysis',
+    'read_file': 'documentreader',
+}
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'{__name__}.{_exports[name]}'), name)
+    globals()[name] = value  # Next time it is found without calling __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
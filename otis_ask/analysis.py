@@ -1,41 +1,202 @@
+import asyncio
+import string
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import pickle
 
-from justai import Agent, get_prompt, set_prompt_file
 from justdays import Day
 
+from otis_ask.cache import ResponseCache, SingleFlight, make_key
 from otis_ask.checks import Check, Checks
-from otis_ask.prompting import create_prompt
+from otis_ask.classifier import Classification, classify_locally
+from otis_ask.clients import agent_pool, stream_chat
+from otis_ask.instrumentation import emit, span
+from otis_ask.prompting import create_combined_prompt, create_prompt
 
 from functools import wraps
 
 MODEL = 'gpt-4-turbo-preview'
+LLM_THREADS = 32  # Upper limit of LLM calls that the async api runs in parallel
+CLASSIFY_PREFIX_LENGTH = 4000  # Number of characters sent to the LLM when the local classifier is unsure
+# The types that the CLASSIFY_AND_ANALYZE prompt asks for, any other TYPE line is a malformed answer
+COMBINED_DOCUMENT_TYPES = ('vaststellingsovereenkomst', 'arbeidsovereenkomst', 'loonstrook', 'ander type')
+CHECK_CACHE_FILE = 'check_cache.sqlite'
+PROMPT_FILE = Path(__file__).absolute().parent / "prompts.toml"
 
+response_cache = ResponseCache()
+check_cache = ResponseCache(CHECK_CACHE_FILE, max_entries=200_000)  # Answers per (document, check)
+llm_executor = ThreadPoolExecutor(max_workers=LLM_THREADS, thread_name_prefix='llm')
+flights = SingleFlight()  # LLM calls in progress, flights.coalesced counts the calls that were saved
 
-def cached(func):
+
+_prompts_mtime = None  # Modification time of PROMPT_FILE when it was last loaded
+
+
+def load_prompts():
+    """ Make prompts.toml the active prompt file. It is parsed again only when it changed on disk or when another
+    prompt file was activated in the meantime """
+    from justai import get_prompt, set_prompt_file  # justai imports openai, which is slow. Only when it is needed
+
+    global _prompts_mtime
+    mtime = PROMPT_FILE.stat().st_mtime_ns
     try:
-        with open('gpt_cache.pickle', 'rb') as f:
-            func.cache = pickle.load(f)
-    except FileNotFoundError:
-        func.cache = {}
+        get_prompt('NO_ADVICE')
+        active = mtime == _prompts_mtime
+    except KeyError:
+        active = False
+    if not active:
+        set_prompt_file(PROMPT_FILE)
+        _prompts_mtime = mtime
 
+
+def cached(func):
+    """ Store the responses of func(prompt, model, temperature) in response_cache.
+    Concurrent calls with the same arguments, in this process or in other processes that share the cache file,
+    wait for the first one and share its response instead of calling func again """
     @wraps(func)
-    def wrapper(*args):
-        try:
-            return func.cache[args]
-        except KeyError:
-            func.cache[args] = result = func(*args)
-            with open('gpt_cache.pickle', 'wb') as f:
-                pickle.dump(func.cache, f)
-            return result
+    def wrapper(prompt: str, model: str = MODEL, temperature: float = 0):
+        key = make_key(model, temperature, prompt)
+        result = response_cache.get(key)
+        if result is None:
+            result = flights.run(key, compute, key, prompt, model, temperature)
+        return result
+
+    def compute(key: str, prompt: str, model: str, temperature: float):
+        result = claim_response(key)
+        if result is None:
+            try:
+                result = func(prompt, model, temperature)
+                response_cache.set(key, result)
+            finally:
+                response_cache.release(key)
+        return result
+
+    wrapper.cache = response_cache
+    wrapper.flights = flights
     return wrapper
 
 
+def claim_response(key: str) -> str | None:
+    """ Claim key in response_cache so other processes wait for this one, the caller must release it.
+    When another process already asked the same, wait for it and return its response instead, without a claim """
+    while not response_cache.claim(key):  # Another process is asking the same
+        result = response_cache.wait(key)
+        if result is not None:
+            flights.count()
+            return result
+    result = response_cache.peek(key)  # The other process may have finished between our miss and claim
+    if result is not None:
+        response_cache.release(key)
+    return result
+
+
 @cached
-def doprompt(prompt: str) -> str:
-    gpt = Agent(MODEL)
-    gpt.temperature = 0
-    return gpt.chat(prompt)
+def doprompt(prompt: str, model: str = MODEL, temperature: float = 0) -> str:
+    with span('llm_call', model=model) as s, agent_pool.agent(model, temperature) as gpt:
+        response = gpt.chat(prompt)
+        if hasattr(gpt, 'last_token_count'):
+            prompt_tokens, response_tokens, _ = gpt.last_token_count()
+            s.set(prompt_tokens=prompt_tokens, response_tokens=response_tokens)
+        return response
+
+
+def doprompt_stream(prompt: str, model: str = MODEL, temperature: float = 0):
+    """ Yields the response in chunks while the LLM generates it. The complete response is cached like doprompt.
+    Like doprompt it joins the same call in progress, and doprompt calls join this one """
+    key = make_key(model, temperature, prompt)
+    response = response_cache.get(key)
+    while response is None:
+        future, leader = flights.join(key)
+        if leader:
+            break
+        response = future.result()  # None when the leader stopped streaming, then ask again
+    if response is not None:
+        yield response
+        return
+
+    try:
+        response = yield from stream_response(key, prompt, model, temperature)
+    except GeneratorExit:  # The caller stopped reading, the response is incomplete
+        flights.land(key)
+        raise
+    except BaseException as e:
+        flights.land(key, error=e)
+        raise
+    flights.land(key, response)
+
+
+def stream_response(key: str, prompt: str, model: str, temperature: float):
+    """ Stream the response from the LLM unless another process is asking the same. Returns the whole response """
+    response = claim_response(key)
+    if response is not None:
+        yield response
+        return response
+    try:
+        chunks = []
+        with span('llm_call', model=model, stream=True) as s, agent_pool.agent(model, temperature) as gpt:
+            start = time.perf_counter()
+            for chunk in stream_chat(gpt, prompt):
+                if not chunks:
+                    s.set(first_token_seconds=time.perf_counter() - start)
+                chunks += [chunk]
+                yield chunk
+        response = ''.join(chunks)
+        response_cache.set(key, response)
+        return response
+    finally:
+        response_cache.release(key)
+
+
+async def doprompt_async(prompt: str, model: str = MODEL, temperature: float = 0) -> str:
+    """ Awaitable doprompt. The blocking LLM call runs in llm_executor so the event loop stays free """
+    future = flights.follow(make_key(model, temperature, prompt))
+    if future is not None:  # Wait for the same call in progress without taking up an executor thread
+        response = await asyncio.wrap_future(future)
+        if response is not None:  # None when that call gave up
+            return response
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(llm_executor, doprompt, prompt, model, temperature)
+
+
+def ask(steps):
+    """ Run steps, a generator that yields the prompts it needs answered and receives the responses, and return
+    its result. Classification and analysis are written once as steps, ask and ask_async only differ in how they
+    call the LLM """
+    done, value = advance(steps)
+    while not done:
+        try:
+            response = doprompt(value)
+        except Exception as e:
+            done, value = advance(steps, error=e)
+        else:
+            done, value = advance(steps, response)
+    return value
+
+
+async def ask_async(steps):
+    """ ask with doprompt_async. The steps themselves run in llm_executor as well: they read and write the check
+    cache and score the document sections, which would block the event loop """
+    loop = asyncio.get_running_loop()
+    done, value = await loop.run_in_executor(llm_executor, advance, steps)
+    while not done:
+        try:
+            response = await doprompt_async(value)
+        except Exception as e:
+            done, value = await loop.run_in_executor(llm_executor, advance, steps, None, e)
+        else:
+            done, value = await loop.run_in_executor(llm_executor, advance, steps, response)
+    return value
+
+
+def advance(steps, response: str = None, error: Exception = None) -> tuple[bool, object]:
+    """ Send the response or throw the error into steps.
+    Returns (True, result) when the steps are finished, otherwise (False, the next prompt) """
+    try:
+        if error is not None:
+            return False, steps.throw(error)
+        return False, steps.send(response)
+    except StopIteration as stop:
+        return True, stop.value
 
 
 def analyze_vso(text: str, ao_checks):
@@ -52,159 +213,315 @@ def analyze_ao(text: str, vso_checks):
     return analyze_document("ao", text, vso_checks, ao_checks)
 
 
+async def analyze_vso_async(text: str, ao_checks):
+    vso_checks = Checks('vso_checks.toml')
+    return await analyze_document_async("vso", text, vso_checks, ao_checks)
+
+
+async def analyze_ao_async(text: str, vso_checks):
+    ao_checks = Checks('ao_checks.toml')
+    return await analyze_document_async("ao", text, vso_checks, ao_checks)
+
+
 def check_document_type(document_text: str):
-    agent = Agent(MODEL)
-    agent.temperature = 0
+    return classify_document(document_text).document_type
 
-    set_prompt_file(Path(__file__).absolute().parent / "prompts.toml")
-    prompt = get_prompt('CHECK_DOCUMENT_TYPE', document_text=document_text)
-    response = doprompt(prompt)
-    return response.strip().lower()
 
+async def check_document_type_async(document_text: str):
+    return (await classify_document_async(document_text)).document_type
+
+
+def classify_document(document_text: str) -> Classification:
+    """ Classify locally when that is conclusive, otherwise ask the LLM using the start of the document """
+    return ask(classify_steps(document_text))
+
+
+async def classify_document_async(document_text: str) -> Classification:
+    return await ask_async(classify_steps(document_text))
 
-def analyze_document(document_type: str, document_text: str, vso_checks: Checks, ao_checks: Checks):
-    # gpt = GPT()
-    # gpt.model = "gpt-4-1106-preview"
-    # gpt.temperature = 0
 
-    set_prompt_file(Path(__file__).absolute().parent / "prompts.toml")
+def classify_steps(document_text: str):
+    """ classify_document as steps for ask or ask_async """
+    with span('classify') as s:
+        classification = classify_locally(document_text)
+        if not classification:
+            response = yield document_type_prompt(document_text)
+            classification = Classification(response.strip().lower(), None, 'llm')
+        s.set(document_type=classification.document_type, method=classification.method,
+              confidence=classification.confidence)
+    return classification
+
+
+def document_type_prompt(document_text: str) -> str:
+    from justai import get_prompt
+    load_prompts()
+    return get_prompt('CHECK_DOCUMENT_TYPE', document_text=document_text[:CLASSIFY_PREFIX_LENGTH])
+
+
+def select_checks(document_type: str, vso_checks: Checks, ao_checks: Checks) -> Checks:
     if document_type == 'vso':
-        checks = vso_checks
+        return vso_checks
     elif document_type == 'ao':
-        checks = ao_checks
-    else:
-        raise ValueError(f"Unknown document type: {document_type}")
-    prompt = create_prompt(document_text=document_text, checks=checks)
-    print(prompt)
-    response = doprompt(prompt)
-    # print(response)
-    process_response(response, checks)  # Fill in value and passed fields in checks
+        return ao_checks
+    raise ValueError(f"Unknown document type: {document_type}")
 
-    return checks
 
+def analyze_document(document_type: str, document_text: str, vso_checks: Checks, ao_checks: Checks):
+    """ Fill checks with the answers from check_cache and ask the LLM only for the checks that are not cached """
+    return ask(analyze_steps(document_type, document_text, vso_checks, ao_checks))
 
-def process_response(response, checks):
-    lines = response.strip().split('\n')
-    for line in lines:
-        if not line.strip():
-            continue
-        try:
-            number, value = line.split(' ', 1)
-        except ValueError:
-            number, value = line, ''
-        try:
-            i = int(number)
-            check = checks[i-1]
-        except ValueError:
-            print('Error: ', line)
-            continue
-        except IndexError:
-            continue
-
-        # Determine if check is passed
-        check.value = value
-        check.passed = False
-        if value and value.lower() != 'nee':
-            if check.check_type == str:
-                check.passed = True
-            elif check.check_type == Day:
-                try:  # Day type only passes when it can be converted to a valid Day
-                    check.value = Day(value)
-                    check.passed = True
-                except ValueError:
-                    pass
-            else:
-                raise ValueError(f"Unknown check type: {check.check_type}")
 
-    return checks
+async def analyze_document_async(document_type: str, document_text: str, vso_checks: Checks, ao_checks: Checks):
+    return await ask_async(analyze_steps(document_type, document_text, vso_checks, ao_checks))
 
 
-def check_vso_with_ao(vso_checks: Checks, ao_checks: Checks) -> tuple[Checks, str]:
+def analyze_steps(document_type: str, document_text: str, vso_checks: Checks, ao_checks: Checks):
+    """ analyze_document as steps for ask or ask_async """
+    load_prompts()
+    checks = select_checks(document_type, vso_checks, ao_checks)
+    with span('analyze', document_type=document_type) as s:
+        missing_checks, keys = apply_cached_answers(document_text, checks)
+        s.set(checks=len(checks), cached_checks=len(checks) - len(missing_checks))
+        if missing_checks:
+            prompt = create_prompt(document_text=document_text, checks=missing_checks)
+            emit('debug.prompt', prompt=prompt)
+            response = yield prompt
+            answered = process_lines(response, missing_checks)  # Fill in value and passed fields in checks
+            store_answers(answered, keys)
+
+    return checks
 
-    extra_checks = Checks()
-    extra_advice = ''
 
-    ########## Check op de opzegtermijn ##########
+def check_key(document_hash: str, check: Check) -> str:
+    """ The answer to a check only depends on the document and on how the check is asked """
+    return make_key(MODEL, document_hash, check.id, check.prompt, check.check_type.__name__, check.options)
 
-    # Opzegdatum is de laatste dag van de maand van ondertekening + 1
-    # Opzegtermijn is:
-    # 4 maanden als de werknemer 15 jaar of langer in dienst is,
-    # 3 maanden als de werknemer 10 jaar of langer in dienst is,
-    # 2 maanden als de werknemer 5 jaar of langer in dienst is,
-    # 1 maand als de werknemer korter dan 5 jaar in dienst is.
-    # Einddatum moet dus minimaal zoveel maanden veder liggen dan de opzegdatum
-    def try_to_make_day_type(value):
-        # When coming back from the frontend, dates are strings
-        try:
-            return Day(value)
-        except:
-            return value
-
-    datum_ondertekening = try_to_make_day_type(vso_checks.get('DATUM_ONDERTEKENING').value)
-    einddatum = try_to_make_day_type(vso_checks.get('EINDDATUM').value)
-    startdatum = try_to_make_day_type(ao_checks.get('STARTDATUM').value)
-
-    opzegtermijn_str = ''
-    if type(datum_ondertekening) == type(einddatum) == type(startdatum) == Day:
-        opzegdatum = datum_ondertekening.last_day_of_month() + 1
-        years = (einddatum - startdatum) / 365.25
-        opzegtermijn = 4 if years > 15 else 3 if years > 10 else 2 if years > 5 else 1
-        opzegtermijn_str = f'minimaal {opzegtermijn} maanden'
-        passed = einddatum >= opzegdatum.plus_months(opzegtermijn)
-        if not passed:
-            extra_advice += get_prompt('TERMINATION_TERM_DETAILS', opzegtermijn=opzegtermijn)
-    else:
-        passed = False
-        extra_advice += get_prompt('DATES_MISSING')
-
-    extra_checks.add(Check('OPZEGTERMIJN', 'Opzegtermijn', '', Day, [], True, passed, opzegtermijn_str))
-
-    ########## Check op relatiebeding ##########
-
-    passed = True
-    if ao_checks.get('RELATIEBEDING').value == 'ja':
-        if vso_checks.get('RELATIEBEDING').value != 'nee':
-            passed = False
-            text = 'Niet vervallen'
-            extra_advice += get_prompt('RELATIEBEDING_NIET_VERVALLEN')
+
+def apply_cached_answers(document_text: str, checks: Checks) -> tuple[Checks, dict]:
+    """ Fill in the checks that have a cached answer for this document.
+    Returns the checks that still need to be asked and the cache keys to store their answers under """
+    document_hash = make_key(document_text)
+    missing_checks = Checks()
+    keys = {}
+    for check in checks:
+        key = check_key(document_hash, check)
+        value = check_cache.get(key)
+        if value is None:
+            missing_checks.add(check)
+            keys[check.id] = key
         else:
-            text = 'Vervallen'
-    else:
-        text = 'Geen'
-    extra_checks.add(Check('RELATEBEDING', 'Relatiebeding', '', str, [], True, passed, text))
-
-    ########## Check op concurrentiebeding ##########
-
-    passed = True
-    if ao_checks.get('CONCURRENTIEBEDING').value == 'ja':
-        if vso_checks.get('CONCURRENTIEBEDING').value != 'nee':
-            passed = False
-            text = 'Niet vervallen'
-            extra_advice += get_prompt('CONCURRENTIEBEDING_NIET_VERVALLEN')
+            fill_check(check, value)
+    return missing_checks, keys
+
+
+def store_answers(checks: list[Check], keys: dict):
+    """ Store the answers of checks that the LLM answered. Checks that it left out, like when the response was cut
+    off, are not stored so they are asked again the next time """
+    for check in checks:
+        check_cache.set(keys[check.id], str(check.value))
+
+
+def analyze_document_stream(document_type: str, document_text: str, vso_checks: Checks, ao_checks: Checks):
+    """ Like analyze_document but yields every check as soon as its answer is known.
+    Cached answers come first, the others follow line by line while the LLM is still answering.
+    Checks that the LLM does not answer are not yielded. """
+    load_prompts()
+    checks = select_checks(document_type, vso_checks, ao_checks)
+    missing_checks, keys = apply_cached_answers(document_text, checks)
+    for check in checks:
+        if check.id not in keys:
+            yield check
+    if missing_checks:
+        prompt = create_prompt(document_text=document_text, checks=missing_checks)
+        emit('debug.prompt', prompt=prompt)
+        answered = []
+        for line in stream_lines(doprompt_stream(prompt)):
+            check = process_line(line, missing_checks)
+            if check:
+                answered += [check]
+                yield check
+        store_answers(answered, keys)
+
+
+async def analyze_document_stream_async(document_type: str, document_text: str, vso_checks: Checks,
+                                        ao_checks: Checks):
+    """ Async iterator version of analyze_document_stream """
+    async for check in iterate_in_executor(
+            analyze_document_stream(document_type, document_text, vso_checks, ao_checks)):
+        yield check
+
+
+async def iterate_in_executor(generator):
+    """ Run a blocking generator in llm_executor and yield its items without blocking the event loop """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for item in generator:
+                loop.call_soon_threadsafe(queue.put_nowait, ('item', item))
+            loop.call_soon_threadsafe(queue.put_nowait, ('done', None))
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ('error', e))
+
+    producer = loop.run_in_executor(llm_executor, produce)
+    while True:
+        kind, item = await queue.get()
+        if kind == 'item':
+            yield item
+        elif kind == 'error':
+            raise item
         else:
-            text = 'Vervallen'
-    else:
-        text = 'Geen'
-    extra_checks.add(Check('CONCURRENTIEBEDING', 'Concurrentiebeding', '', str, [], True, passed, text))
-
-    ########## Check op pensioenregeling ##########
-
-    passed = True
-    if ao_checks.get('PENSIOENREGELING').value == 'ja':
-        if vso_checks.get('PENSIOENREGELING').value != 'ja':
-            passed = False
-            text = 'Niet voortgezet'
-            extra_advice += get_prompt('PENSIOEN_VOORTZETTEN')
+            break
+    await producer
+
+
+def stream_lines(chunks):
+    """ Join the chunks and split them in lines, yielding each line as soon as it is complete """
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split('\n')
+        yield from lines
+    if buffer:
+        yield buffer
+
+
+def classify_and_analyze(document_text: str, combined: bool = False) -> tuple[str, Checks | None]:
+    """ The document type and for a VSO or AO its answered checks, None for other types.
+    With combined, a document that the local classifier is unsure about is classified and analyzed in a single
+    LLM call. When that answer is malformed the type and the checks are asked one after the other """
+    return ask(classify_and_analyze_steps(document_text, combined))
+
+
+async def classify_and_analyze_async(document_text: str, combined: bool = False) -> tuple[str, Checks | None]:
+    return await ask_async(classify_and_analyze_steps(document_text, combined))
+
+
+def classify_and_analyze_steps(document_text: str, combined: bool):
+    """ classify_and_analyze as steps for ask or ask_async """
+    if combined and not classify_locally(document_text):
+        load_prompts()
+        with span('classify_and_analyze') as s:
+            response = yield create_combined_prompt(document_text, Checks('vso_checks.toml'),
+                                                    Checks('ao_checks.toml'))
+            result = process_combined_response(response, document_text)
+            s.set(malformed=result is None)
+        if result is not None:
+            return result
+    document_type = (yield from classify_steps(document_text)).document_type
+    match document_type:
+        case 'vaststellingsovereenkomst':
+            checks = yield from analyze_steps('vso', document_text, Checks('vso_checks.toml'), None)
+            return document_type, checks
+        case 'arbeidsovereenkomst':
+            checks = yield from analyze_steps('ao', document_text, None, Checks('ao_checks.toml'))
+            return document_type, checks
+        case _:
+            return document_type, None
+
+
+def process_combined_response(response: str, document_text: str) -> tuple[str, Checks | None] | None:
+    """ Parse the answer to the CLASSIFY_AND_ANALYZE prompt: a TYPE line followed by the numbered answers.
+    Returns None when the answer does not have that format, names a type the prompt did not ask for or does not
+    answer every check """
+    lines = response.strip().split('\n')
+    words = lines[0].split(None, 1)
+    document_type = words[1].strip(string.punctuation + string.whitespace).lower() if len(words) == 2 else ''
+    if len(words) != 2 or words[0].strip(':').upper() != 'TYPE' or document_type not in COMBINED_DOCUMENT_TYPES:
+        emit('malformed_response', line=lines[0])
+        return None
+    match document_type:
+        case 'vaststellingsovereenkomst':
+            checks = Checks('vso_checks.toml')
+        case 'arbeidsovereenkomst':
+            checks = Checks('ao_checks.toml')
+        case _:
+            return document_type, None
+    answered = process_lines('\n'.join(lines[1:]), checks)
+    if len({check.id for check in answered}) < len(checks):  # Like when the answer was cut off
+        emit('malformed_response', line=lines[0], answered=len(answered), checks=len(checks))
+        return None
+    document_hash = make_key(document_text)  # Later analyses of the same document can use these answers
+    store_answers(answered, {check.id: check_key(document_hash, check) for check in answered})
+    return document_type, checks
+
+
+async def analyze_many_async(texts: list[str], concurrency: int = 8,
+                             combined: bool = False) -> list[tuple[str, Checks | None] | Exception]:
+    """ Classify and analyze many documents at once, with at most concurrency documents in flight.
+    Returns a (document_type, checks) tuple per text, in the order of texts, or the exception when that document
+    failed, so one failing LLM call does not lose the results of the others.
+    checks is None when the document is not a vaststellingsovereenkomst or arbeidsovereenkomst.
+    combined is passed on to classify_and_analyze """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze_one(text):
+        async with semaphore:
+            return await classify_and_analyze_async(text, combined)
+
+    return await asyncio.gather(*(analyze_one(text) for text in texts), return_exceptions=True)
+
+
+def process_response(response, checks):
+    process_lines(response, checks)
+    return checks
+
+
+def process_lines(response: str, checks: Checks) -> list[Check]:
+    """ Fill in the checks from the numbered answer lines. Returns the checks that were answered """
+    answered = [process_line(line, checks) for line in response.strip().split('\n')]
+    return [check for check in answered if check]
+
+
+def process_line(line: str, checks: Checks) -> Check | None:
+    """ Fill in the check that a numbered answer line refers to. Returns that check or None """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        number, value = line.split(' ', 1)
+    except ValueError:
+        number, value = line, ''
+    try:
+        i = int(number)
+        check = checks[i-1]
+    except ValueError:
+        emit('unparsed_line', line=line)
+        return None
+    except IndexError:
+        return None
+
+    fill_check(check, value)
+    return check
+
+
+def fill_check(check: Check, value: str):
+    """ Set the value of the check from the LLM answer and determine if check is passed """
+    check.value = value
+    check.passed = False
+    if value and value.lower() != 'nee':
+        if check.check_type == str:
+            check.passed = True
+        elif check.check_type == Day:
+            try:  # Day type only passes when it can be converted to a valid Day
+                check.value = Day(value)
+                check.passed = True
+            except ValueError:
+                pass
         else:
-            text = 'Voortgezet'
-    else:
-        text = 'Geen'
-    extra_checks.add(Check('PENSIOENREGELING', 'Voortzetten van pensioenregeling', '', str, [], True, passed, text))
+            raise ValueError(f"Unknown check type: {check.check_type}")
 
-    return extra_checks, extra_advice
+
+def check_vso_with_ao(vso_checks: Checks, ao_checks: Checks) -> tuple[Checks, str]:
+    """ Checks that combine the VSO with the AO. The rules are defined in combined_rules.toml, use
+    rules.evaluate directly to evaluate many dossiers at once """
+    from otis_ask.rules import evaluate  # Imports numpy
+    return evaluate([(vso_checks, ao_checks)])[0]
 
 
 def generate_advice(vso_checks: Checks, combined_checks: Checks, extra_advice: str) -> str:
+    from justai import get_prompt
     if not vso_checks:
         return ''  # Happens when only an AO is uploaded
     # Check for missing data
@@ -213,7 +530,7 @@ def generate_advice(vso_checks: Checks, combined_checks: Checks, extra_advice: s
     missing_clauses_sentence = ''
     for check in vso_checks:
         if not check.passed:
-            print(f'Check {check.id} failed with options {check.options} and value {check.value}')
+            emit('check_failed', id=check.id, options=check.options, value=check.value)
             if check.options == ['ja', 'nee']:
                 missing_clauses_sentence += f'<li>{check.description}</li>'
             else:
@@ -223,7 +540,7 @@ def generate_advice(vso_checks: Checks, combined_checks: Checks, extra_advice: s
     if combined_checks:
         for check in combined_checks:
             if not check.passed:
-                print(f'Check {check.id} failed with options {check.options} and value {check.value}')
+                emit('check_failed', id=check.id, options=check.options, value=check.value)
                 failed_combined_checks_sentence += f'<li>{check.description}</li>'
 
     if missing_data_sentence:
@@ -0,0 +1,208 @@
+""" Bulk processing of archived dossiers from a local directory or an S3 prefix.
+
+Every subdirectory (or S3 'folder') directly under the source is a dossier holding a VSO and/or an AO.
+Downloads, text extraction and LLM analysis run in separate pools, so with many dossiers in flight the stages
+overlap. The result of each dossier is written as json to the output, completed dossiers are recorded in a
+checkpoint file so an interrupted run resumes where it stopped.
+
+Usage: python -m otis_ask.batch <source dir or s3://bucket/prefix> <output dir or s3://bucket/prefix>
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from otis_ask.analysis import check_vso_with_ao, classify_and_analyze, generate_advice
+from otis_ask.documentreader import read_file
+from otis_ask.instrumentation import emit
+
+
+class LocalStore:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def list(self) -> list[str]:
+        return sorted(str(path.relative_to(self.directory)) for path in self.directory.rglob('*') if path.is_file())
+
+    def read(self, key: str) -> bytes:
+        return (self.directory / key).read_bytes()
+
+    def write(self, key: str, text: str):
+        path = self.directory / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+
+
+class S3Store:
+    def __init__(self, bucket: str, prefix: str = '', client=None):
+        """ client is a boto3 S3 client, by default one for the configured AWS credentials and region """
+        if client is None:
+            import boto3  # Optional, pip install otis_ask[s3]
+            client = boto3.client('s3')
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def list(self) -> list[str]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        keys = [item['Key'] for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix)
+                for item in page.get('Contents', [])]
+        return sorted(key[len(self.prefix):] for key in keys if not key.endswith('/'))
+
+    def read(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+
+    def write(self, key: str, text: str):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=text.encode('utf-8'),
+                               ContentType='application/json')
+
+
+def open_store(location: str, client=None):
+    """ s3://bucket/prefix gives an S3Store that uses client, anything else a LocalStore """
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3Store(bucket, prefix, client)
+    return LocalStore(location)
+
+
+def group_dossiers(keys: list[str]) -> dict[str, list[str]]:
+    """ dossier_id -> document keys. Files directly in the source are a dossier of their own """
+    dossiers = {}
+    for key in keys:
+        dossier_id = key.split('/', 1)[0] if '/' in key else key.rsplit('.', 1)[0]
+        dossiers.setdefault(dossier_id, []).append(key)
+    return dossiers
+
+
+class Checkpoint:
+    """ Append only file with one json line per finished dossier """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.done = set()
+        if self.path.exists():
+            for line in self.path.read_text().splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    if record['status'] == 'done':
+                        self.done.add(record['dossier'])
+        self._lock = threading.Lock()
+
+    def record(self, dossier_id: str, status: str, error: str = None):
+        with self._lock, open(self.path, 'a') as f:
+            f.write(json.dumps({'dossier': dossier_id, 'status': status, 'error': error}) + '\n')
+            if status == 'done':
+                self.done.add(dossier_id)
+
+
+class BatchPipeline:
+    def __init__(self, source, output, checkpoint_file='batch_checkpoint.jsonl', download_workers=16,
+                 extract_workers=4, llm_workers=16, combined=False):
+        """ combined classifies and analyzes each document in a single LLM call, see classify_and_analyze """
+        self.source = source
+        self.output = output
+        self.checkpoint = Checkpoint(checkpoint_file)
+        self.combined = combined
+        self.download_pool = ThreadPoolExecutor(download_workers, thread_name_prefix='download')
+        self.extract_pool = ThreadPoolExecutor(extract_workers, thread_name_prefix='extract')
+        self.llm_pool = ThreadPoolExecutor(llm_workers, thread_name_prefix='analyze')
+        # Enough dossiers in flight to keep every stage busy
+        self.dossier_workers = download_workers + extract_workers + llm_workers
+        self.stats = {'dossiers': 0, 'documents': 0, 'failed': 0, 'failed_documents': 0, 'skipped': 0}
+        self._stats_lock = threading.Lock()
+
+    def run(self) -> dict:
+        """ Process all dossiers that are not in the checkpoint yet. Returns counts and throughput """
+        dossiers = group_dossiers(self.source.list())
+        todo = {dossier_id: keys for dossier_id, keys in dossiers.items() if dossier_id not in self.checkpoint.done}
+        self.stats['skipped'] = len(dossiers) - len(todo)
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(self.dossier_workers, thread_name_prefix='dossier') as executor:
+                for _ in executor.map(self.process_dossier, todo.keys(), todo.values()):
+                    self.report(start)
+        finally:
+            for pool in (self.download_pool, self.extract_pool, self.llm_pool):
+                pool.shutdown()
+        return self.report(start)
+
+    def report(self, start) -> dict:
+        seconds = time.perf_counter() - start
+        with self._stats_lock:
+            stats = dict(self.stats, seconds=seconds,
+                         dossiers_per_s=self.stats['dossiers'] / seconds if seconds else 0.0,
+                         documents_per_s=self.stats['documents'] / seconds if seconds else 0.0)
+        emit('batch_progress', **stats)
+        return stats
+
+    def process_dossier(self, dossier_id: str, keys: list[str]):
+        try:
+            result = self.analyze_dossier(dossier_id, keys)
+            self.output.write(f'{dossier_id}.json', json.dumps(result, ensure_ascii=False))
+            self.checkpoint.record(dossier_id, 'done')
+            with self._stats_lock:
+                self.stats['dossiers'] += 1
+                self.stats['documents'] += len(keys)
+        except Exception as e:
+            self.checkpoint.record(dossier_id, 'failed', f'{type(e).__name__}: {e}')
+            with self._stats_lock:
+                self.stats['failed'] += 1
+
+    def analyze_dossier(self, dossier_id: str, keys: list[str]) -> dict:
+        downloads = [self.download_pool.submit(self.source.read, key) for key in keys]
+        extractions = [self.extract_pool.submit(read_file, download.result()) for download in downloads]
+        # Documents without text, like images and unknown file types, are not sent to the LLM
+        analyses = [self.llm_pool.submit(classify_and_analyze, text, self.combined) if text is not None else None
+                    for text in (extraction.result() for extraction in extractions)]
+
+        vso_checks = ao_checks = None
+        documents = []
+        for key, analysis in zip(keys, analyses):
+            if analysis is None:
+                documents += [{'key': key, 'document_type': None, 'error': 'Unsupported document type'}]
+                emit('batch_document_failed', dossier=dossier_id, key=key)
+                with self._stats_lock:
+                    self.stats['failed_documents'] += 1
+                continue
+            document_type, checks = analysis.result()
+            documents += [{'key': key, 'document_type': document_type}]
+            if document_type == 'vaststellingsovereenkomst':
+                vso_checks = checks
+            elif document_type == 'arbeidsovereenkomst':
+                ao_checks = checks
+
+        combined_checks = None
+        extra_advice = ''
+        if vso_checks and ao_checks:
+            combined_checks, extra_advice = check_vso_with_ao(vso_checks, ao_checks)
+        advice = generate_advice(vso_checks, combined_checks, extra_advice)
+        return {'dossier': dossier_id,
+                'documents': documents,
+                'vso_checks': vso_checks.serializable() if vso_checks else None,
+                'ao_checks': ao_checks.serializable() if ao_checks else None,
+                'combined_checks': combined_checks.serializable() if combined_checks else None,
+                'advice': advice}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze all dossiers in a directory or S3 prefix')
+    parser.add_argument('source', help='Directory or s3://bucket/prefix with one subdirectory per dossier')
+    parser.add_argument('output', help='Directory or s3://bucket/prefix to write the results to')
+    parser.add_argument('--checkpoint', default='batch_checkpoint.jsonl', help='File with the finished dossiers')
+    parser.add_argument('--download-workers', type=int, default=16)
+    parser.add_argument('--extract-workers', type=int, default=4)
+    parser.add_argument('--llm-workers', type=int, default=16)
+    parser.add_argument('--combined', action='store_true', help='Classify and analyze in one LLM call')
+    args = parser.parse_args()
+
+    pipeline = BatchPipeline(open_store(args.source), open_store(args.output), args.checkpoint,
+                             args.download_workers, args.extract_workers, args.llm_workers, args.combined)
+    stats = pipeline.run()
+    print(f"{stats['dossiers']} dossiers ({stats['documents']} documents) in {stats['seconds']:.1f}s: "
+          f"{stats['dossiers_per_s']:.2f} dossiers/s, {stats['failed']} failed, {stats['skipped']} already done, "
+          f"{stats['failed_documents']} unsupported documents")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+""" Persistent store for LLM responses and extracted texts that can be shared by many threads and processes.
+Entries live in a SQLite database in WAL mode so every miss writes a single row instead of rewriting the cache.
+Values that are being computed are marked in a pending table, so other processes can wait for them instead of
+computing them again. A claim records the process that made it, so the claim of a process that was killed is taken
+over at once. """
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from otis_ask.instrumentation import emit
+
+CACHE_FILE = 'gpt_cache.sqlite'
+EVICT_INTERVAL = 64  # Enforce max_entries and ttl once every this many writes
+PENDING_TIMEOUT = 300  # Seconds after which a claim of a hanging process, or one on another host, is taken over
+POLL_INTERVAL = 0.05  # Seconds between checks while waiting for another process, doubles up to MAX_POLL_INTERVAL
+MAX_POLL_INTERVAL = 1.0
+HOST = socket.gethostname()
+# Tells this process apart from an earlier one with the same pid, like the main process of a restarted container
+PROCESS_TOKEN = uuid.uuid4().hex
+
+
+def make_key(*parts) -> str:
+    """ Hash the parts (model, temperature, prompt, ...) into a fixed length cache key """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def abandoned(host: str, pid: int, token: str) -> bool:
+    """ Whether the process that made a claim on this host has died. Processes on other hosts can't be checked """
+    if host != HOST:
+        return False
+    if pid == os.getpid():
+        return token != PROCESS_TOKEN
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:  # Runs as another user
+        pass
+    return False
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_FILE, max_entries: int = 10_000, ttl: float = None, max_bytes: int = None):
+        """ max_entries caps the number of stored responses and max_bytes their total size,
+        least recently used ones are evicted first.
+        ttl is the maximum age in seconds of an entry, None means entries never expire.
+        path None disables the cache: nothing is stored and every get is a miss. """
+        self.path = str(path) if path is not None else None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self):
+        # SQLite connections can't be shared between threads or survive a fork, so keep one per thread per process
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS responses '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(pending)')}
+            if columns and 'pid' not in columns:  # Claims of an older version, they only live while computing
+                conn.execute('DROP TABLE pending')
+            conn.execute('CREATE TABLE IF NOT EXISTS pending (key TEXT PRIMARY KEY, started REAL NOT NULL, '
+                         'host TEXT NOT NULL, pid INTEGER NOT NULL, token TEXT NOT NULL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str):
+        """ Returns the cached value for key or None when it is not present or expired """
+        if self.path is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+        if row and self.ttl is not None and now - row[1] > self.ttl:
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        emit('cache', cache=self.path, hit=row is not None)
+        if row is None:
+            return None
+        conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def set(self, key: str, value: str):
+        if self.path is None:
+            return
+        now = time.time()
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                     (key, value, now, now))
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % EVICT_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def peek(self, key: str):
+        """ The value for key like get, but without counting a hit or miss or updating the access time """
+        if self.path is None:
+            return None
+        row = self._connection().execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def claim(self, key: str) -> bool:
+        """ Mark key as being computed by this process. False when another process is already computing it.
+        Claims of processes that died are taken over at once, on another host after PENDING_TIMEOUT """
+        if self.path is None:
+            return True
+        conn = self._connection()
+        while True:  # Again when the claim was released or taken over in the meantime
+            now = time.time()
+            cursor = conn.execute(
+                'INSERT INTO pending (key, started, host, pid, token) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET started = excluded.started, host = excluded.host, '
+                'pid = excluded.pid, token = excluded.token WHERE pending.started < ?',
+                (key, now, HOST, os.getpid(), PROCESS_TOKEN, now - PENDING_TIMEOUT))
+            if cursor.rowcount == 1:
+                return True
+            row = conn.execute('SELECT host, pid, token FROM pending WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                if not abandoned(*row):
+                    return False
+                emit('claim_taken_over', key=key, pid=row[1])
+                conn.execute('DELETE FROM pending WHERE key = ? AND host = ? AND pid = ? AND token = ?', (key, *row))
+
+    def release(self, key: str):
+        if self.path is not None:
+            self._connection().execute('DELETE FROM pending WHERE key = ?', (key,))
+
+    def wait(self, key: str):
+        """ Wait while another process computes key. Returns its value, or None when that process gave up """
+        if self.path is None:
+            return None
+        conn = self._connection()
+        interval = POLL_INTERVAL
+        while True:
+            value = self.peek(key)
+            if value is not None:
+                return value
+            row = conn.execute('SELECT started, host, pid, token FROM pending WHERE key = ?', (key,)).fetchone()
+            if row is None or time.time() - row[0] > PENDING_TIMEOUT or abandoned(*row[1:]):
+                return None
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def evict(self):
+        """ Remove expired entries and the least recently used entries above max_entries or max_bytes """
+        if self.path is None:
+            return
+        conn = self._connection()
+        if self.ttl is not None:
+            conn.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,))
+        if self.max_entries:
+            conn.execute('DELETE FROM responses WHERE key IN '
+                         '(SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+        if self.max_bytes:
+            conn.execute('DELETE FROM responses WHERE key IN (SELECT key FROM '
+                         '(SELECT key, SUM(LENGTH(CAST(value AS BLOB))) OVER (ORDER BY accessed DESC) AS total '
+                         'FROM responses) WHERE total > ?)', (self.max_bytes,))
+
+    def clear(self):
+        if self.path is None:
+            return
+        self._connection().execute('DELETE FROM responses')
+        self._connection().execute('DELETE FROM pending')
+
+    def __len__(self):
+        if self.path is None:
+            return 0
+        return self._connection().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self)}
+
+
+class SingleFlight:
+    """ Lets concurrent callers in this process that ask for the same key share a single computation.
+    Computations return None only when they gave up, their followers then try again """
+    def __init__(self):
+        self.coalesced = 0  # Number of callers that got the result of another caller's computation
+        self._flights = {}  # key -> Future of the computation in progress
+        self._lock = threading.Lock()
+
+    def follow(self, key: str) -> Future | None:
+        """ The Future of the computation of key that is in progress, or None """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.coalesced += 1
+        if future is not None:
+            emit('coalesced', key=key)
+        return future
+
+    def count(self):
+        """ Count a caller that got its result from a computation elsewhere, like in another process """
+        with self._lock:
+            self.coalesced += 1
+
+    def join(self, key: str) -> tuple[Future, bool]:
+        """ The Future of the computation of key and whether the caller leads it. A new computation is started when
+        none is in progress, its leader must finish it with land. For computations that run can't wrap, like a
+        response that is streamed """
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            emit('coalesced', key=key)
+        return future, leader
+
+    def land(self, key: str, result=None, error: BaseException = None):
+        """ Finish the computation of key that the caller leads. Without result and error the leader gave up,
+        its followers get None and should try again """
+        with self._lock:
+            future = self._flights.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key: str, func, *args):
+        """ Returns func(*args), or when that is already being computed for key, waits for that result """
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                break
+            result = future.result()
+            if result is not None:
+                return result
+        try:
+            result = func(*args)
+        except BaseException as e:
+            self.land(key, error=e)
+            raise
+        self.land(key, result)
+        return result
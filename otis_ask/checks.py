@@ -1,12 +1,13 @@
 from dataclasses import dataclass
 from pathlib import Path
+import threading
 import tomllib
 import json
 
 from justdays import Day
 
 
-@dataclass
+@dataclass(slots=True)
 class Check:
     id: str
     description: str
@@ -28,34 +29,64 @@ class Check:
                 'options': self.options, 'required': self.required, 'passed': self.passed, 'value': value}
 
 
-class Checks:
-    def __init__(self, toml_file_name: str = None):
-        self.checks = []
-        if toml_file_name:
-            self.load(toml_file_name)
+_templates = {}  # Parsed check files: path -> (mtime, tuple of Check)
+_templates_lock = threading.Lock()
 
-    def get(self, id):
-        for check in self.checks:
-            if check.id == id:
-                return check
-        raise ValueError(f"Check with id {id} not found")
 
-    def load(self, toml_file_name: str):
-        checks_file = Path(__file__).parent / toml_file_name
-        print([f for f in Path('/').iterdir()])
+def load_template(toml_file_name: str) -> tuple[Check, ...]:
+    """ Returns the checks defined in toml_file_name. The file is parsed once per process and again
+    only when its modification time changes. The returned checks are shared and should not be modified """
+    checks_file = Path(__file__).parent / toml_file_name
+    mtime = checks_file.stat().st_mtime_ns
+    template = _templates.get(checks_file)
+    if template and template[0] == mtime:
+        return template[1]
+
+    with _templates_lock:
         with open(checks_file, 'rb') as f:
             data = tomllib.load(f)
 
-        self.checks = []
-
+        checks = []
         for id, item in data.items():
             name = item['description']
             prompt = item['prompt']
             check_type = Day if item.get('type') == 'datum' else str
             options = item.get('options', [])
             required = item.get('required', True)
-            self.checks += [Check(id, name, prompt, check_type, options, required)]
+            checks += [Check(id, name, prompt, check_type, options, required)]
+
+        _templates[checks_file] = (mtime, tuple(checks))
+    return _templates[checks_file][1]
+
 
+class Checks:
+    def __init__(self, toml_file_name: str = None):
+        self.checks = []
+        if toml_file_name:
+            self.load(toml_file_name)
+
+    @property
+    def checks(self):
+        return self._checks
+
+    @checks.setter
+    def checks(self, checks):
+        self._checks = list(checks)
+        self._index = {}
+        for check in self._checks:
+            self._index.setdefault(check.id, check)
+
+    def get(self, id):
+        try:
+            return self._index[id]
+        except KeyError:
+            raise ValueError(f"Check with id {id} not found") from None
+
+    def load(self, toml_file_name: str):
+        """ Fill with fresh (unanswered) copies of the checks in the template of toml_file_name.
+        The options are copied too, so changing them does not change the shared template """
+        self.checks = [Check(check.id, check.description, check.prompt, check.check_type, list(check.options),
+                             check.required) for check in load_template(toml_file_name)]
         return self.checks
 
     def __getitem__(self, index):
@@ -71,7 +102,8 @@ class Checks:
         return len(self.checks)
 
     def add(self, check):
-        self.checks += [check]
+        self._checks.append(check)
+        self._index.setdefault(check.id, check)
 
     def serializable(self):
         return [check.serializable() for check in self.checks]
@@ -79,8 +111,16 @@ class Checks:
     def deserialize(self, json_str):
         data = json.loads(json_str)
         self.checks = []
+        checks = []
         for item in data:
-            check = Check(item['id'], item['description'], item['prompt'], item['check_type'], item['options'],
-                          item['required'], item['passed'], item['value'])
-            self.checks += [check]
+            check_type = Day if item['check_type'] == 'date' else str
+            value = item['value']
+            if check_type == Day:
+                try:  # Dates are stored as strings, values that never were a valid Day stay strings
+                    value = Day(value)
+                except (ValueError, TypeError):
+                    pass
+            checks += [Check(item['id'], item['description'], item['prompt'], check_type, item['options'],
+                             item['required'], item['passed'], value)]
+        self.checks = checks
         return self.checks
@@ -0,0 +1,69 @@
+""" Local document classifier that recognizes clear-cut vaststellingsovereenkomsten and arbeidsovereenkomsten
+without calling the LLM. Only when it is unsure the caller needs to ask the model.
+Documents that mention an arbeidsovereenkomst without being one, like payslips, letters, CAOs and addenda, score
+as OTHER. That lowers the confidence, so they are left to the LLM. """
+import re
+from dataclasses import dataclass
+
+VSO = 'vaststellingsovereenkomst'
+AO = 'arbeidsovereenkomst'
+OTHER = 'other'  # Never returned, documents that look like another type go to the LLM
+
+HEAD_LENGTH = 5000  # Number of characters that are classified, roughly the first two pages
+TITLE_LINES = 5  # Number of non-empty lines at the start of the document that are considered the title
+TITLE_WEIGHT = 6
+MAX_KEYWORD_COUNT = 3  # Repeating a keyword more often does not add to the score
+MIN_SCORE = 6
+MIN_KEYWORD_SCORE = 4  # Keywords are needed on top of the title, a title alone is not conclusive
+CONFIDENCE_THRESHOLD = 0.8
+
+VSO_TITLES = ['vaststellingsovereenkomst', 'beëindigingsovereenkomst', 'beeindigingsovereenkomst']
+AO_TITLES = ['arbeidsovereenkomst', 'arbeidscontract']
+# Titles of documents that mention an arbeidsovereenkomst but are something else. Checked before the others
+OTHER_TITLES = re.compile(r'\b(?:loonstrook|salarisstrook|loonspecificatie|salarisspecificatie|cao|collectieve '
+                          r'arbeidsovereenkomst|addendum|allonge|betreft|geachte)\b')
+
+KEYWORDS = {
+    VSO: {'vaststellingsovereenkomst': 3, 'beëindigingsovereenkomst': 3, 'wederzijds goedvinden': 2,
+          'bedenktijd': 2, 'finale kwijting': 2, 'beëindiging van de arbeidsovereenkomst': 2,
+          'transitievergoeding': 1, 'eindafrekening': 1, 'vrijgesteld van werkzaamheden': 1, 'ww-uitkering': 1,
+          'einddatum': 1},
+    AO: {'proeftijd': 2, 'treedt in dienst': 2, 'in dienst treedt': 2, 'datum van indiensttreding': 2,
+         'vakantiedagen': 1, 'arbeidsduur': 1, 'werktijden': 1, 'bepaalde tijd': 1,
+         'functieomschrijving': 1, 'aanvangsdatum': 1},
+    OTHER: {'loonheffing': 2, 'brutoloon': 2, 'nettoloon': 2, 'netto te betalen': 2, 'loonstrook': 1,
+            'geachte': 2, 'met vriendelijke groet': 2, 'hoogachtend': 2, 'addendum': 2,
+            'in aanvulling op de arbeidsovereenkomst': 2, 'werkingssfeer': 2, 'cao-partijen': 2},
+}
+
+
+@dataclass
+class Classification:
+    document_type: str
+    confidence: float | None  # None when the LLM decided
+    method: str  # 'local' or 'llm'
+
+
+def classify_locally(document_text: str) -> Classification | None:
+    """ Returns the classification if the title and keywords clearly point to one document type, otherwise None """
+    head = document_text[:HEAD_LENGTH].lower()
+    keyword_scores = {document_type: sum(weight * min(head.count(keyword), MAX_KEYWORD_COUNT)
+                                         for keyword, weight in keywords.items())
+                      for document_type, keywords in KEYWORDS.items()}
+    scores = dict(keyword_scores)
+
+    # A VSO title often also mentions the arbeidsovereenkomst it ends, so check the VSO titles first
+    title = ' '.join([line for line in head.splitlines() if line.strip()][:TITLE_LINES])
+    if OTHER_TITLES.search(title):
+        scores[OTHER] += TITLE_WEIGHT
+    elif any(word in title for word in VSO_TITLES):
+        scores[VSO] += TITLE_WEIGHT
+    elif any(word in title for word in AO_TITLES):
+        scores[AO] += TITLE_WEIGHT
+
+    document_type = max(scores, key=scores.get)
+    confidence = scores[document_type] / sum(scores.values()) if scores[document_type] else 0.0
+    if (document_type == OTHER or scores[document_type] < MIN_SCORE
+            or keyword_scores[document_type] < MIN_KEYWORD_SCORE or confidence < CONFIDENCE_THRESHOLD):
+        return None
+    return Classification(document_type, confidence, 'local')
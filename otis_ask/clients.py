@@ -0,0 +1,77 @@
+""" Process wide pool of LLM agents, so calls reuse configured clients and their keep-alive connections """
+import queue
+import threading
+from contextlib import contextmanager
+
+POOL_SIZE = 32  # Maximum number of agents, and thus of simultaneous LLM calls, per process
+
+
+def create_agent(model: str):
+    from justai import Agent  # justai imports openai, which is slow, so not before the first agent is needed
+    return Agent(model)
+
+
+class AgentPool:
+    def __init__(self, size: int = POOL_SIZE, factory=create_agent):
+        """ factory(model) creates a new agent. All agents share the http client of the first one """
+        self.size = size
+        self.factory = factory
+        self._idle = queue.LifoQueue()  # Most recently used first, its connection is most likely still open
+        self._created = 0
+        self._client = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def agent(self, model: str, temperature: float = 0):
+        """ Borrow an agent configured for model and temperature. Blocks when all agents are in use """
+        agent = self._acquire(model)
+        agent.model = model
+        agent.temperature = temperature
+        agent.reset()  # Agents keep the conversation, every call starts a new one
+        try:
+            yield agent
+        finally:
+            self._idle.put(agent)
+
+    def _acquire(self, model: str):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        try:
+            agent = self.factory(model)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        with self._lock:
+            if self._client is None:
+                self._client = getattr(agent, 'client', None)
+            elif hasattr(agent, 'client'):
+                agent.client = self._client
+        return agent
+
+
+def stream_chat(agent, prompt: str):
+    """ Yields the response of agent to prompt in chunks as the model generates them """
+    if not hasattr(agent, 'client'):  # Agents without an OpenAI client, like test stubs, answer in one go
+        yield agent.chat(prompt)
+        return
+    completion = agent.client.chat.completions.create(
+        model=agent.model,
+        messages=[{'role': 'system', 'content': agent.system()}, {'role': 'user', 'content': prompt}],
+        temperature=agent.temperature,
+        max_tokens=agent.max_tokens,
+        stream=True)
+    for chunk in completion:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+agent_pool = AgentPool()
@@ -1,24 +1,59 @@
+import hashlib
+import importlib.util
+import multiprocessing
+import os
 import sys
 import io
 import mimetypes
+import subprocess
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
 
-import cv2
-import numpy as np
-from pdf2image import convert_from_path  # first: brew install poppler. For heroku: https://stackoverflow.com/questions/54739063/install-poppler-onto-heroku-server-django
-import \
-    pytesseract  # first: brew install tesseract; brew install tesseract-lang; ln /opt/homebrew/Cellar/tesseract/5.3.3/bin/tesseract /usr/local/bin/tesseract
-from PIL import Image
-from pypdf import PdfReader
+from otis_ask.cache import ResponseCache, make_key
+from otis_ask.instrumentation import emit, span
+
+OCR_DPI = 200
+OCR_WORKERS = os.cpu_count() or 1
+MIN_PAGE_TEXT_LENGTH = 50  # Pages with less text than this in their text layer are OCR'd
+OCR_LANGUAGE = 'nld'  # Tesseract language model, needs its language data: brew install tesseract-lang
+OCR_MEMORY_LIMIT = None  # Maximum bytes of page images in memory at the same time. None: one page per worker
+OCR_PAGE_MEMORY_FACTOR = 4  # Tesseract works on several copies of the page image
+PREPROCESSING = 'grayscale-render'  # Describes how pages are rendered and preprocessed. Change it when that changes.
+OCR_ENGINE = 'tesserocr'  # 'tesserocr' (in process, falls back to pytesseract when not installed) or 'pytesseract'
+OCR_SETTINGS = ('OCR_DPI', 'OCR_LANGUAGE', 'OCR_ENGINE')  # Passed on to the OCR pool, its workers don't inherit them
+
+PDF_MIME_TYPE = 'application/pdf'
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+EXTRACTION_CACHE_FILE = 'extraction_cache.sqlite'
+extraction_cache = ResponseCache(EXTRACTION_CACHE_FILE, max_entries=None, max_bytes=500_000_000)
+
+
+class OCRFailed(Exception):
+    """ A scanned page could not be OCR'd and has no text layer to fall back on """
+
+
+@cache
+def cuda_available():
+    """ Check for GPU availability for OpenCV, once per process """
+    import cv2
+    return cv2.cuda.getCudaEnabledDeviceCount() > 0
 
 
 # Function to preprocess an image with OpenCV
 def preprocess_image(image):
-    image_cv = np.array(image)
+    if image.mode == 'L':  # Pages are rendered in grayscale already, no need to copy them
+        return image
 
-    # Check for GPU availability for OpenCV
-    use_gpu = cv2.cuda.getCudaEnabledDeviceCount() > 0
+    import cv2
+    import numpy as np
+    from PIL import Image
 
-    if use_gpu:
+    image_cv = np.array(image)
+    if cuda_available():
         # Upload image to GPU
         image_gpu = cv2.cuda_GpuMat(image_cv)
         # Convert to grayscale
@@ -31,49 +66,320 @@ def preprocess_image(image):
     return Image.fromarray(image_cv)
 
 
-def read_file(file_path, poppler_path=None, mime_type=None):
+def read_file(file_path, poppler_path=None, mime_type=None, timings: dict = None, use_cache=True):
+    """ Extract the text from a text, pdf or docx document.
+    file_path is a path or the document itself as bytes, memoryview or binary file object.
+    Without mime_type the type is sniffed from the first bytes of the document.
+    Extracted texts of pdf and docx files are cached on the file contents and the extractor settings, except when
+    the OCR of a page failed, so the document is read again once OCR works.
+    Raises OCRFailed when a scanned page could not be OCR'd and has no text layer """
+    source = file_path if isinstance(file_path, (str, os.PathLike)) else read_bytes(file_path)
     if not mime_type:
-        mime_type = mimetypes.guess_type(file_path)[0]
+        mime_type = sniff_mime_type(source)
+
+    with span('read_file', mime_type=mime_type) as s:
+        if not use_cache or mime_type == 'text/plain':
+            return extract_text(source, poppler_path, mime_type, timings)
+
+        key = extraction_key(source, mime_type)
+        text = extraction_cache.get(key)
+        s.set(cache_hit=text is not None)
+        if timings is not None:
+            timings['extraction_cache_hit'] = text is not None
+        if text is None:
+            stats = timings if timings is not None else {}
+            text = extract_text(source, poppler_path, mime_type, stats)
+            if text is not None and not stats.get('ocr_failed_pages'):
+                extraction_cache.set(key, text)
+        return text
 
+
+def read_bytes(data) -> bytes:
+    if hasattr(data, 'read'):
+        data = data.read()
+        if isinstance(data, str):
+            raise TypeError('The document is read as text, open it in binary mode')
+    return bytes(data)
+
+
+def sniff_mime_type(source):
+    """ Determine the mime type from the magic bytes of a path or bytes.
+    Paths fall back to their extension, and like bytes to their content when the extension is unknown """
+    if isinstance(source, bytes):
+        header = source[:8]
+    else:
+        with open(source, 'rb') as f:
+            header = f.read(8)
+
+    if header.startswith(b'%PDF'):
+        return PDF_MIME_TYPE
+    if header.startswith(b'PK\x03\x04'):
+        try:
+            with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as z:
+                if 'word/document.xml' in z.namelist():
+                    return DOCX_MIME_TYPE
+        except zipfile.BadZipFile:
+            pass
+    if not isinstance(source, bytes):
+        mime_type = mimetypes.guess_type(source)[0]
+        if mime_type:
+            return mime_type
+        with open(source, 'rb') as f:
+            source = f.read()
+    try:
+        source.decode('utf-8')
+        return 'text/plain'
+    except UnicodeDecodeError:
+        return None
+
+
+def extraction_key(source, mime_type):
+    if isinstance(source, bytes):
+        file_hash = hashlib.sha256(source).hexdigest()
+    else:
+        with open(source, 'rb') as f:
+            file_hash = hashlib.file_digest(f, 'sha256').hexdigest()
+    if mime_type != PDF_MIME_TYPE:  # Only pdfs are OCR'd
+        return make_key(file_hash, mime_type)
+    return make_key(file_hash, mime_type, OCR_DPI, OCR_LANGUAGE, MIN_PAGE_TEXT_LENGTH, PREPROCESSING,
+                    configured_ocr_engine())
+
+
+def extract_text(source, poppler_path=None, mime_type=None, timings: dict = None):
     match mime_type:
         case 'text/plain':
-            with open(file_path, 'r') as f:
+            if isinstance(source, bytes):
+                try:
+                    return source.decode('utf-8')
+                except UnicodeDecodeError:
+                    return source.decode('cp1252', errors='replace')
+            with open(source, 'r') as f:
                 return f.read()
 
         case 'application/pdf':
-            return read_pdf(file_path, poppler_path=poppler_path)
+            return read_pdf(source, poppler_path=poppler_path, timings=timings)
 
         case 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-            return read_docx(file_path)
+            return read_docx(source)
 
 
-def read_pdf(file_path, poppler_path=None):
-    # Try to extract text from the PDF using pypdf
-    text = read_pdf_with_pypdf(file_path)
-    if len(text) > 200:
-        return text
+def read_pdf(file_path, poppler_path=None, timings: dict = None):
+    """ Extract the text from a pdf path or pdf bytes. Pages with images and without a usable text layer are OCR'd,
+    the others are read with pypdf. A page whose OCR fails keeps its text layer, OCRFailed is raised when it has
+    none. When timings is passed it is filled with the time spent per stage and the number of failed pages """
+    start = time.perf_counter()
+    pages = read_pdf_page_layers(file_path)
+    page_texts = [page_text for page_text, _ in pages]
+    pypdf_seconds = time.perf_counter() - start
+    if timings is not None:
+        timings['pypdf_seconds'] = pypdf_seconds
+
+    # Pages with images that are (nearly) empty are most likely scanned. OCR those using pdf2image and tesseract.
+    # Pages without images have nothing to OCR, like a blank page in a text document
+    scanned_pages = [number for number, (_, has_images) in enumerate(pages, start=1) if has_images]
+    emit('pypdf', seconds=pypdf_seconds, pages=len(page_texts), scanned_pages=len(scanned_pages))
+    failed_pages = []
+    if scanned_pages:
+        for number, page_text in zip(scanned_pages, ocr_pdf(file_path, scanned_pages, poppler_path, timings)):
+            if isinstance(page_text, Exception):
+                if not page_texts[number - 1].strip():
+                    raise OCRFailed(f'Page {number} could not be OCR\'d and has no text layer') from page_text
+                failed_pages += [number]  # Keep its text layer
+            else:
+                page_texts[number - 1] = page_text
+    if timings is not None:
+        timings['ocr_failed_pages'] = len(failed_pages)
+    return "\n".join(page_texts).strip()
+
+
+@cache
+def ocr_executor():
+    """ Process pool that is shared by all OCR jobs in this process so workers are only started once.
+    It has ocr_window() workers, which keeps the pages in memory within OCR_MEMORY_LIMIT for the whole process,
+    however many documents are read at the same time. Set OCR_WORKERS, OCR_MEMORY_LIMIT and OCR_SETTINGS before
+    the first OCR.
+    Workers are started with forkserver or spawn: the pool is used from extraction threads, and forking a process
+    with threads can deadlock the child """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    settings = {name: globals()[name] for name in OCR_SETTINGS}
+    return ProcessPoolExecutor(max_workers=ocr_window(), mp_context=context, initializer=configure_ocr_worker,
+                               initargs=(settings,))
+
+
+def configure_ocr_worker(settings: dict):
+    globals().update(settings)
+
+
+def warm_up_ocr() -> list[str]:
+    """ Start the workers of the OCR pool and load the OCR engine in each, so the first scanned pages don't wait
+    for that. Returns the engine of each worker """
+    futures = [ocr_executor().submit(load_ocr_engine) for _ in range(ocr_window())]
+    return [future.result() for future in futures]
+
 
-    # Alternatively, OCR the PDF using pdf2image and pytesseract
-    images = convert_from_path(file_path, first_page=1, dpi=200, poppler_path=poppler_path)
-    text = ""
-    for image in images:
-        image = preprocess_image(image)  # Preprocess the image
-        text += pytesseract.image_to_string(image) + "\n\n"  # Perform OCR using pytesseract
-    return text
+def load_ocr_engine() -> str:
+    """ Import the modules that render and OCR pages and load the OCR engine, in a worker of the OCR pool """
+    import cv2
+    import pdf2image
+    from PIL import Image
+    return ocr_engine()
+
+
+def ocr_pdf(file_path, pages: list[int], poppler_path=None, timings: dict = None) -> list[str | Exception]:
+    """ Render and OCR the given (1-based) pages of the pdf in parallel. Returns the texts in the order of pages,
+    the exception for the pages whose OCR failed """
+    start = time.perf_counter()
+    # Pages are rendered in the pool, so no more pages are in memory than it has workers
+    futures = [(page, ocr_executor().submit(ocr_page, file_path, page, poppler_path)) for page in pages]
+    results = [page_result(page, future) for page, future in futures]
+
+    ocr_timings = {'ocr_pages': len(pages),
+                   'render_seconds': sum(render_time for _, render_time, _ in results),
+                   'tesseract_seconds': sum(ocr_time for _, _, ocr_time in results),
+                   'ocr_wall_seconds': time.perf_counter() - start}
+    emit('ocr', **ocr_timings)
+    if timings is not None:
+        timings.update(ocr_timings)
+    return [page_text for page_text, _, _ in results]
+
+
+def page_result(page: int, future):
+    try:
+        return future.result()
+    except Exception as e:
+        return ocr_failed(page, e)
+
+
+def ocr_failed(page: int, error: Exception):
+    """ The result of a page that could not be OCR'd, like when poppler or tesseract is not installed """
+    emit('ocr_failed', page=page, error=f'{type(error).__name__}: {error}')
+    return error, 0.0, 0.0
+
+
+def ocr_window():
+    """ Number of pages that are rendered and OCR'd at the same time in this process, limited by OCR_WORKERS and
+    OCR_MEMORY_LIMIT """
+    if not OCR_MEMORY_LIMIT:
+        return OCR_WORKERS
+    page_bytes = int(8.27 * OCR_DPI) * int(11.69 * OCR_DPI) * OCR_PAGE_MEMORY_FACTOR  # A4, one byte per pixel
+    return max(1, min(OCR_WORKERS, OCR_MEMORY_LIMIT // page_bytes))
+
+
+def ocr_page(file_path, page_number: int, poppler_path=None):
+    """ Render a single pdf page in grayscale and OCR it. Returns the text plus the render and OCR time in seconds """
+    start = time.perf_counter()
+    image = render_page(file_path, page_number, poppler_path)
+    rendered = time.perf_counter()
+    image = preprocess_image(image)  # Preprocess the image
+    text = image_to_string(image)
+    return text, rendered - start, time.perf_counter() - rendered
+
+
+def ocr_engine() -> str:
+    """ The OCR engine that is used: OCR_ENGINE, or pytesseract when the tesserocr engine is not available """
+    if OCR_ENGINE == 'tesserocr' and tesseract_api() is not None:
+        return 'tesserocr'
+    return 'pytesseract'
+
+
+def configured_ocr_engine() -> str:
+    """ The OCR engine that OCR_ENGINE selects, as far as can be told without loading it. tesserocr is not imported
+    here: that installs signal handlers, which only works on the main thread of a process """
+    if OCR_ENGINE == 'tesserocr' and importlib.util.find_spec('tesserocr') is not None:
+        return 'tesserocr'
+    return 'pytesseract'
+
+
+@cache
+def tesserocr_module():
+    """ The optional tesserocr module, None when it is not installed or can't be imported here """
+    try:
+        import tesserocr
+    except Exception as e:  # Not only ImportError, outside the main thread its import raises ValueError
+        emit('ocr_engine_failed', engine='tesserocr', error=f'{type(e).__name__}: {e}')
+        return None
+    return tesserocr
+
+
+_tesseract = threading.local()  # Tesseract engines are not thread safe, every thread gets its own
+
+
+def tesseract_api():
+    """ The Tesseract engine of this thread. Loading the language data is done once, not for every page.
+    None when tesserocr is not installed or can't load the language data, a failure is not retried """
+    if getattr(_tesseract, 'language', None) != OCR_LANGUAGE:
+        _tesseract.api = None
+        _tesseract.language = OCR_LANGUAGE
+        tesserocr = tesserocr_module()
+        if tesserocr is not None:
+            try:
+                _tesseract.api = tesserocr.PyTessBaseAPI(lang=OCR_LANGUAGE)
+            except RuntimeError as e:  # Like when the language data is not where tesserocr looks for it
+                emit('ocr_engine_failed', engine='tesserocr', language=OCR_LANGUAGE, error=str(e))
+    return _tesseract.api
+
+
+def image_to_string(image) -> str:
+    if ocr_engine() == 'pytesseract':
+        import pytesseract  # first: brew install tesseract; brew install tesseract-lang
+        return pytesseract.image_to_string(image, lang=OCR_LANGUAGE)  # Writes the image and runs tesseract on it
+
+    # Hand the pixels to the engine in this process directly, without encoding the image
+    if image.mode != 'L':
+        image = image.convert('L')
+    api = tesseract_api()
+    api.SetImageBytes(image.tobytes(), image.width, image.height, 1, image.width)
+    api.SetSourceResolution(OCR_DPI)
+    try:
+        return api.GetUTF8Text()
+    finally:
+        api.Clear()
+
+
+def render_page(source, page_number: int, poppler_path=None):
+    """ Render one page of a pdf path or pdf bytes to a grayscale image """
+    if not isinstance(source, bytes):
+        # first: brew install poppler. For heroku: https://stackoverflow.com/questions/54739063/install-poppler-onto-heroku-server-django
+        from pdf2image import convert_from_path
+        return convert_from_path(source, first_page=page_number, last_page=page_number, dpi=OCR_DPI,
+                                 grayscale=True, single_file=True, poppler_path=poppler_path)[0]
+
+    # Pipe the pdf through the stdin of pdftoppm, pdf2image would write it to a temporary file first
+    pdftoppm = os.path.join(poppler_path, 'pdftoppm') if poppler_path else 'pdftoppm'
+    result = subprocess.run([pdftoppm, '-f', str(page_number), '-l', str(page_number), '-r', str(OCR_DPI), '-gray',
+                             '-singlefile', '-'], input=source, capture_output=True, check=True)
+    from PIL import Image
+    return Image.open(io.BytesIO(result.stdout))
 
 
 def read_pdf_with_pypdf(path_or_data):
-    if type(path_or_data) == bytes:
+    return "\n".join(read_pdf_pages_with_pypdf(path_or_data)).strip()
+
+
+def read_pdf_pages_with_pypdf(path_or_data) -> list[str]:
+    """ Returns the text layer of each page of the pdf """
+    return [page_text for page_text, _ in read_pdf_page_layers(path_or_data)]
+
+
+def read_pdf_page_layers(path_or_data) -> list[tuple[str, bool]]:
+    """ Returns the text layer of each page of the pdf and, for pages with less than MIN_PAGE_TEXT_LENGTH text,
+    whether they contain images. Looking for images parses the page again, pages with enough text are not OCR'd """
+    from pypdf import PdfReader
+    if isinstance(path_or_data, (bytes, bytearray, memoryview)):
         path_or_data = io.BytesIO(path_or_data)
     reader = PdfReader(path_or_data)
-    text = ""
+    layers = []
     for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text.strip()
+        page_text = page.extract_text()
+        layers += [(page_text, len(page_text.strip()) < MIN_PAGE_TEXT_LENGTH and len(page.images) > 0)]
+    return layers
 
 
 def read_docx(file_path):
     import docx2txt
+    if isinstance(file_path, bytes):
+        file_path = io.BytesIO(file_path)
     return docx2txt.process(file_path)
 
 
@@ -0,0 +1,69 @@
+""" Pluggable instrumentation for the analysis pipeline.
+Code reports timing spans and metrics through span() and emit(). Nothing is recorded until a hook is installed
+with set_hook(), and without a hook span() returns a shared no-op object so the overhead is a single check. """
+import logging
+import time
+
+_hook = None
+
+
+def set_hook(hook):
+    """ hook(event: str, data: dict) is called for every finished span and emitted metric. None disables it """
+    global _hook
+    _hook = hook
+
+
+def enabled() -> bool:
+    return _hook is not None
+
+
+def emit(event: str, **data):
+    if _hook is not None:
+        _hook(event, data)
+
+
+class Span:
+    """ Measures the duration of a with block and reports it as event with the seconds and any attributes """
+    def __init__(self, event: str, data: dict):
+        self.event = event
+        self.data = data
+        self.start = None
+
+    def set(self, **data):
+        self.data.update(data)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.data['seconds'] = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.data['error'] = exc_type.__name__
+        emit(self.event, **self.data)
+        return False
+
+
+class NullSpan:
+    def set(self, **data):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(event: str, **data):
+    if _hook is None:
+        return NULL_SPAN
+    return Span(event, data)
+
+
+def logging_hook(event: str, data: dict):
+    """ Ready made hook that writes all events to the otis_ask logger at debug level """
+    logging.getLogger('otis_ask').debug('%s %s', event, data)
@@ -1,11 +1,19 @@
-from gpteasy import get_prompt
 from justdays import Day
 
+from otis_ask import instrumentation
 from otis_ask.checks import Checks
+from otis_ask.relevance import PROMPT_TOKEN_BUDGET, select_relevant_text
 
 
-def create_prompt(document_text: str, checks: Checks):
-
+def create_prompt(document_text: str, checks: Checks, token_budget: int = PROMPT_TOKEN_BUDGET, stats: dict = None):
+    """ When the document is larger than token_budget only the sections relevant for the checks are included.
+    Pass token_budget=None to always include the whole document. stats is filled with the tokens saved """
+    from gpteasy import get_prompt  # Imported when it is used, gpteasy imports openai which is slow
+    if stats is None and instrumentation.enabled():
+        stats = {}
+    document_text = select_relevant_text(document_text, checks, token_budget, stats)
+    if stats is not None:
+        instrumentation.emit('prompt_tokens', **stats)
     checks_string = create_checks_string(checks)
     answer_format = create_answer_format(checks)
 
@@ -14,8 +22,27 @@ def create_prompt(document_text: str, checks: Checks):
     return prompt.replace('\\n', '\n')
 
 
+def create_combined_prompt(document_text: str, vso_checks: Checks, ao_checks: Checks,
+                           token_budget: int = PROMPT_TOKEN_BUDGET, stats: dict = None):
+    """ Prompt that asks for the document type and the answers to the checks of that type at once """
+    from gpteasy import get_prompt
+    if stats is None and instrumentation.enabled():
+        stats = {}
+    all_checks = Checks()
+    all_checks.checks = list(vso_checks) + list(ao_checks)
+    document_text = select_relevant_text(document_text, all_checks, token_budget, stats)
+    if stats is not None:
+        instrumentation.emit('prompt_tokens', **stats)
+
+    prompt = get_prompt('CLASSIFY_AND_ANALYZE', document_text=document_text,
+                        vso_checks=create_checks_string(vso_checks), ao_checks=create_checks_string(ao_checks),
+                        answer_format=create_answer_format(vso_checks))
+    return prompt.replace('\\n', '\n')
+
+
 def create_checks_string(checks: Checks):
     """ Convert a list of checks to a text that can be used in the prompt """
+    from gpteasy import get_prompt
     date_checks = []
     checks_string = ''
     for i, check in enumerate(checks):
@@ -0,0 +1,101 @@
+""" Select the parts of a document that are relevant for the checks, so long contracts fit in a token budget.
+The document is split in sections which are ranked per check with a local BM25 index on the check prompt. """
+import math
+import re
+from collections import Counter
+
+from otis_ask.checks import Checks
+
+PROMPT_TOKEN_BUDGET = 6000  # Maximum number of document tokens that are sent along with the checks
+MIN_SECTION_LENGTH = 300  # Paragraphs shorter than this (in characters) are merged with the next one
+CHARS_PER_TOKEN = 4  # Rough estimate for Dutch text, saves loading a tokenizer
+
+STOPWORDS = {'de', 'het', 'een', 'en', 'van', 'dat', 'die', 'in', 'is', 'op', 'te', 'voor', 'met', 'als', 'zijn',
+             'er', 'aan', 'om', 'of', 'bij', 'ook', 'tot', 'uit', 'door', 'naar', 'over', 'dan', 'wordt', 'deze',
+             'dit', 'niet', 'wel', 'heeft', 'hebben', 'welke', 'zo', 'geef', 'alleen', 'antwoord'}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def words(text: str) -> list[str]:
+    return [word for word in re.findall(r'\w+', text.lower()) if len(word) > 2 and word not in STOPWORDS]
+
+
+def split_sections(text: str) -> list[str]:
+    """ Split on blank lines and article headings, merging small paragraphs so each section has some context """
+    paragraphs = re.split(r'\n\s*\n|\n(?=\s*(?:artikel|article)\s+\d)', text, flags=re.IGNORECASE)
+    sections = []
+    current = ''
+    for paragraph in paragraphs:
+        if not paragraph.strip():
+            continue
+        current = f'{current}\n\n{paragraph.strip()}' if current else paragraph.strip()
+        if len(current) >= MIN_SECTION_LENGTH:
+            sections += [current]
+            current = ''
+    if current:
+        sections += [current]
+    return sections
+
+
+class BM25:
+    def __init__(self, documents: list[str], k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(words(document)) for document in documents]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    def scores(self, query: str) -> list[float]:
+        terms = set(words(query))
+        result = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1))
+            for term in terms:
+                tf = counts.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            result += [score]
+        return result
+
+
+def select_relevant_text(document_text: str, checks: Checks, token_budget: int = PROMPT_TOKEN_BUDGET,
+                         stats: dict = None) -> str:
+    """ Returns the document_text reduced to the sections that are most relevant for the checks.
+    The first and last section (parties and signatures) are always kept, the others are added round robin
+    in order of relevance per check while they fit in token_budget. Documents within budget are returned as is.
+    When stats is passed it is filled with the document tokens, the tokens that are sent and the tokens saved. """
+    document_tokens = estimate_tokens(document_text)
+    sections = split_sections(document_text)
+    if not token_budget or document_tokens <= token_budget or len(sections) <= 2:
+        selected_text = document_text
+    else:
+        index = BM25(sections)
+        rankings = []
+        for check in checks:
+            query = ' '.join([check.prompt, check.description] + check.options)
+            scores = index.scores(query)
+            rankings += [[i for i in sorted(range(len(sections)), key=lambda i: -scores[i]) if scores[i] > 0]]
+
+        selected = {0, len(sections) - 1}
+        used = sum(estimate_tokens(sections[i]) for i in selected)
+        for rank in range(max(map(len, rankings), default=0)):
+            for ranking in rankings:
+                if rank < len(ranking) and ranking[rank] not in selected:
+                    tokens = estimate_tokens(sections[ranking[rank]])
+                    if used + tokens <= token_budget:
+                        selected.add(ranking[rank])
+                        used += tokens
+        selected_text = '\n\n'.join(sections[i] for i in sorted(selected))
+
+    if stats is not None:
+        stats['document_tokens'] = document_tokens
+        stats['prompt_document_tokens'] = estimate_tokens(selected_text)
+        stats['tokens_saved'] = document_tokens - stats['prompt_document_tokens']
+    return selected_text
@@ -0,0 +1,143 @@
+""" Rules that combine the VSO and AO answers of a dossier, defined in combined_rules.toml.
+
+Every rule is evaluated for all dossiers at once with numpy: answers are gathered per check into arrays and dates
+become datetime64 so years of service and notice periods are computed with array arithmetic. Re-evaluating
+thousands of stored results after a rule change therefore costs about as much as gathering their answers.
+"""
+import threading
+import tomllib
+from pathlib import Path
+
+import numpy as np
+from justdays import Day
+
+from otis_ask.checks import Check, Checks
+from otis_ask.serialization import gc_paused
+
+RULES_FILE = 'combined_rules.toml'
+PROMPT_FILE = Path(__file__).absolute().parent / "prompts.toml"
+DAYS_PER_YEAR = 365.25
+
+_rules = {}  # Parsed rule files: path -> (mtime, rules)
+_rules_lock = threading.Lock()
+
+
+def load_rules(toml_file_name: str = RULES_FILE) -> dict:
+    """ Rule id -> rule definition. Parsed again only when the file changes """
+    rules_file = Path(__file__).parent / toml_file_name
+    mtime = rules_file.stat().st_mtime_ns
+    rules = _rules.get(rules_file)
+    if rules and rules[0] == mtime:
+        return rules[1]
+
+    with _rules_lock:
+        with open(rules_file, 'rb') as f:
+            _rules[rules_file] = (mtime, tomllib.load(f))
+    return _rules[rules_file][1]
+
+
+def prompt(key: str, **variables) -> str:
+    """ get_prompt that loads our prompt file only when another one is active, parsing it costs more than a
+    whole evaluation of a single dossier """
+    from justai import get_prompt, set_prompt_file  # justai imports openai, which is slow
+    try:
+        return get_prompt(key, **variables)
+    except KeyError:
+        set_prompt_file(PROMPT_FILE)
+        return get_prompt(key, **variables)
+
+
+def to_day(value):
+    """ Day for Day values and date strings (as they come back from the frontend), None for anything else """
+    if isinstance(value, Day):
+        return value
+    try:
+        return Day(value)
+    except Exception:
+        return None
+
+
+def date_column(results: list[Checks], check_id: str) -> np.ndarray:
+    """ The values of check_id as datetime64[D], NaT where the value is not a valid date """
+    days = [to_day(checks.get(check_id).value) for checks in results]
+    return np.array([day.str if day else 'NaT' for day in days], dtype='datetime64[D]')
+
+
+def equals_column(results: list[Checks], check_id: str, value: str) -> np.ndarray:
+    return np.fromiter((checks.get(check_id).value == value for checks in results), dtype=bool, count=len(results))
+
+
+def plus_months(days: np.ndarray, months: np.ndarray) -> np.ndarray:
+    """ Vectorized Day.plus_months: the same day of the month, or the last day when the month is shorter """
+    month = days.astype('datetime64[M]')
+    day_of_month = days - month.astype('datetime64[D]')
+    target = month + months
+    last_day = (target + 1).astype('datetime64[D]') - 1
+    return np.minimum(target.astype('datetime64[D]') + day_of_month, last_day)
+
+
+def notice_period(rule: dict, vso_results: list[Checks], ao_results: list[Checks]):
+    """ The end date must be at least the notice period after the first day of the month after signing.
+    The notice period depends on the years of service """
+    signing_date = date_column(vso_results, rule['signing_date'])
+    end_date = date_column(vso_results, rule['end_date'])
+    start_date = date_column(ao_results, rule['start_date'])
+    valid = ~(np.isnat(signing_date) | np.isnat(end_date) | np.isnat(start_date))
+
+    notice_date = (signing_date.astype('datetime64[M]') + 1).astype('datetime64[D]')  # Last day of month + 1
+    years = (end_date - start_date) / np.timedelta64(1, 'D') / DAYS_PER_YEAR
+    months = np.select([years > limit for limit in rule['years_of_service']], rule['notice_months'],
+                       rule['default_notice_months'])
+    passed = valid & (end_date >= plus_months(notice_date, months))
+
+    advice = {}
+    values, advices = [], []
+    for is_valid, is_passed, notice_months in zip(valid.tolist(), passed.tolist(), months.tolist()):
+        if not is_valid:
+            values += ['']
+            advices += [prompt(rule['missing_advice'])]
+            continue
+        values += [f'minimaal {notice_months} maanden']
+        if is_passed:
+            advices += ['']
+        else:
+            if notice_months not in advice:
+                advice[notice_months] = prompt(rule['advice'], opzegtermijn=notice_months)
+            advices += [advice[notice_months]]
+    return Day, passed, values, advices
+
+
+def clause(rule: dict, vso_results: list[Checks], ao_results: list[Checks]):
+    """ A clause in the AO must be handled in the VSO: passes when the AO does not have it or the VSO agrees """
+    in_ao = equals_column(ao_results, rule['check'], rule['ao_value'])
+    handled = equals_column(vso_results, rule['check'], rule['vso_value'])
+    passed = ~in_ao | handled
+    outcome = np.where(in_ao, np.where(handled, 1, 2), 0)
+    advice = prompt(rule['advice'])
+    values = [rule['texts'][i] for i in outcome.tolist()]
+    advices = [advice if i == 2 else '' for i in outcome.tolist()]
+    return str, passed, values, advices
+
+
+RULE_KINDS = {'notice_period': notice_period, 'clause': clause}
+
+
+def evaluate(pairs: list[tuple[Checks, Checks]], toml_file_name: str = RULES_FILE) -> list[tuple[Checks, str]]:
+    """ Evaluate all rules for a list of (vso_checks, ao_checks) pairs.
+    Returns per pair the combined checks and the extra advice, like check_vso_with_ao """
+    vso_results = [vso_checks for vso_checks, _ in pairs]
+    ao_results = [ao_checks for _, ao_checks in pairs]
+
+    outcomes = []
+    for rule_id, rule in load_rules(toml_file_name).items():
+        check_type, passed, values, advices = RULE_KINDS[rule['kind']](rule, vso_results, ao_results)
+        outcomes += [(rule_id, rule['description'], check_type, passed.tolist(), values, advices)]
+
+    results = []
+    with gc_paused():
+        for i in range(len(pairs)):
+            combined_checks = Checks()
+            combined_checks.checks = [Check(rule_id, description, '', check_type, [], True, passed[i], values[i])
+                                      for rule_id, description, check_type, passed, values, _ in outcomes]
+            results += [(combined_checks, ''.join(advices[i] for *_, advices in outcomes))]
+    return results
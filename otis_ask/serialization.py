@@ -0,0 +1,160 @@
+""" Compact binary storage for many Checks results at once.
+
+The checks of all result sets are stored column by column: integer columns as arrays and all text in one string
+table, so the description, prompt and options that every dossier shares with its template are stored only once.
+Check types and Day values survive the round trip; Days are stored as date ordinals.
+
+Layout (little endian): header, checks per set, the check columns, option indices, string lengths, utf-8 strings.
+"""
+import gc
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
+from datetime import date
+
+from justdays import Day
+
+from otis_ask.checks import Check, Checks
+
+MAGIC = b'OTCK'
+VERSION = 1
+HEADER = struct.Struct('<4sBIIII')  # magic, version, sets, checks, option references, strings
+
+# Flag bits per check
+REQUIRED = 1
+PASSED = 2
+DAY_TYPE = 4
+# Kind of value, stored in the bits above the flags
+VALUE_STR = 0
+VALUE_DAY = 1
+VALUE_NONE = 2
+KIND_SHIFT = 3
+
+COLUMNS = 6  # id, description, prompt, value, first option, flags; followed by the option count
+LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def uint_array(values=()) -> array:
+    return array('I', values)
+
+
+def to_bytes(values: array) -> bytes:
+    if not LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_bytes(data, offset: int, count: int) -> tuple[array, int]:
+    end = offset + count * 4
+    values = uint_array()
+    values.frombytes(data[offset:end])
+    if not LITTLE_ENDIAN:
+        values.byteswap()
+    return values, end
+
+
+@contextmanager
+def gc_paused():
+    """ Creating many small objects triggers the cyclic garbage collector over and over, while none of them
+    can be garbage yet. Pausing it makes bulk decoding several times faster """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def dumps(results: list[Checks]) -> bytes:
+    """ Encode a list of Checks in one go """
+    strings = {}
+    string_index = strings.setdefault  # Returns the index of a string, adding it when new
+
+    set_sizes = uint_array(len(checks) for checks in results)
+    columns = [uint_array() for _ in range(COLUMNS + 1)]
+    ids, descriptions, prompts, values, first_options, flags, option_counts = columns
+    option_refs = uint_array()
+    for checks in results:
+        for check in checks:
+            ids.append(string_index(check.id, len(strings)))
+            descriptions.append(string_index(check.description, len(strings)))
+            prompts.append(string_index(check.prompt, len(strings)))
+            value = check.value
+            if isinstance(value, Day):
+                values.append(value.as_date().toordinal())
+                kind = VALUE_DAY
+            elif value is None:
+                values.append(0)
+                kind = VALUE_NONE
+            else:
+                values.append(string_index(value, len(strings)))
+                kind = VALUE_STR
+            first_options.append(len(option_refs))
+            option_counts.append(len(check.options))
+            option_refs.extend(string_index(option, len(strings)) for option in check.options)
+            flags.append(check.required * REQUIRED | check.passed * PASSED | (check.check_type == Day) * DAY_TYPE
+                         | kind << KIND_SHIFT)
+
+    encoded = [string.encode('utf-8') for string in strings]
+    parts = [HEADER.pack(MAGIC, VERSION, len(set_sizes), len(ids), len(option_refs), len(encoded)),
+             to_bytes(set_sizes), *(to_bytes(column) for column in columns), to_bytes(option_refs),
+             to_bytes(uint_array(map(len, encoded))), *encoded]
+    return b''.join(parts)
+
+
+def loads(data: bytes) -> list[Checks]:
+    """ Decode the output of dumps() back into a list of Checks """
+    data = memoryview(data)
+    magic, version, set_count, check_count, option_count, string_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a serialized Checks file or unsupported version')
+
+    offset = HEADER.size
+    set_sizes, offset = from_bytes(data, offset, set_count)
+    columns = []
+    for _ in range(COLUMNS + 1):
+        column, offset = from_bytes(data, offset, check_count)
+        columns += [column]
+    option_refs, offset = from_bytes(data, offset, option_count)
+    lengths, offset = from_bytes(data, offset, string_count)
+
+    text = bytes(data[offset:])
+    strings = []
+    position = 0
+    for length in lengths:
+        strings += [text[position:position + length].decode('utf-8')]
+        position += length
+    options = [strings[i] for i in option_refs]
+
+    with gc_paused():
+        checks = decode_checks(columns, strings, options)
+        results = []
+        start = 0
+        for size in set_sizes:
+            result = Checks()
+            result.checks = checks[start:start + size]
+            results += [result]
+            start += size
+    return results
+
+
+def decode_checks(columns: list[array], strings: list[str], options: list[str]) -> list[Check]:
+    days = {}  # Day values are not modified in place, one instance per date is enough
+    checks = []
+    for id, description, prompt, value, first_option, flag, option_count in zip(*columns):
+        kind = flag >> KIND_SHIFT
+        if kind == VALUE_STR:
+            value = strings[value]
+        elif kind == VALUE_DAY:
+            if value not in days:
+                days[value] = Day(date.fromordinal(value))
+            value = days[value]
+        else:
+            value = None
+        checks += [Check(strings[id], strings[description], strings[prompt], Day if flag & DAY_TYPE else str,
+                         options[first_option:first_option + option_count], bool(flag & REQUIRED),
+                         bool(flag & PASSED), value)]
+    return checks
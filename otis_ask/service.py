@@ -0,0 +1,204 @@
+""" Long running worker that keeps everything warm between documents.
+
+Imports, prompts, check templates, rules, the LLM client pool, the OCR workers and the caches are loaded once at
+start-up, so a request only pays for the extraction and the LLM calls themselves. Text extraction and analysis run
+in separate executors. At most queue_size documents are accepted at a time, further requests get 503 with Retry-After.
+
+    POST /analyze   body: a pdf, docx or text document. Returns the document type and its checks as json,
+                    or 415 when no text can be extracted from the document
+    POST /combine   body: {"vso": [...], "ao": [...]} serialized checks. Returns the combined checks and advice
+    GET  /health    queue and executor status
+
+Usage: python -m otis_ask.service --port 8000
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from otis_ask.analysis import MODEL, check_vso_with_ao, classify_and_analyze, generate_advice, load_prompts
+from otis_ask.checks import Checks, load_template
+from otis_ask.clients import agent_pool
+from otis_ask.documentreader import DOCX_MIME_TYPE, PDF_MIME_TYPE, read_file, warm_up_ocr
+from otis_ask.instrumentation import emit
+from otis_ask.rules import load_rules
+
+QUEUE_SIZE = 64  # Documents accepted at the same time, waiting or in progress
+EXTRACT_WORKERS = 4
+LLM_WORKERS = 16
+RETRY_AFTER = 5  # Seconds, sent to clients when the queue is full
+MAX_BODY_SIZE = 100_000_000
+KNOWN_MIME_TYPES = (PDF_MIME_TYPE, DOCX_MIME_TYPE, 'text/plain')
+
+
+class UnsupportedDocument(Exception):
+    """ No text could be extracted from the document, so there is nothing to ask the LLM """
+
+
+class Worker:
+    def __init__(self, queue_size=QUEUE_SIZE, extract_workers=EXTRACT_WORKERS, llm_workers=LLM_WORKERS,
+                 combined=False):
+        self.queue_size = queue_size
+        self.combined = combined  # Classify and analyze in one LLM call
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.extract_pool = ThreadPoolExecutor(extract_workers, thread_name_prefix='extract')
+        self.llm_pool = ThreadPoolExecutor(llm_workers, thread_name_prefix='analyze')
+        self.stats = {'accepted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'in_progress': 0}
+        self._stats_lock = threading.Lock()
+
+    def warm_up(self):
+        """ Load everything that would otherwise be loaded on the first request """
+        load_prompts()
+        load_template('vso_checks.toml')
+        load_template('ao_checks.toml')
+        load_rules()
+        with agent_pool.agent(MODEL):  # Creates the http client that all agents share
+            pass
+        # The document readers, and the OCR workers with their engine
+        import cv2
+        import pdf2image
+        import pypdf
+        from PIL import Image
+        warm_up_ocr()
+
+    def count(self, **changes):
+        with self._stats_lock:
+            for key, change in changes.items():
+                self.stats[key] += change
+
+    def analyze(self, document: bytes, mime_type: str = None) -> dict | None:
+        """ Extract and analyze document. Returns None without doing anything when the queue is full.
+        Raises UnsupportedDocument when no text can be extracted """
+        if not self.slots.acquire(blocking=False):
+            self.count(rejected=1)
+            return None
+        self.count(accepted=1, in_progress=1)
+        start = time.perf_counter()
+        try:
+            text = self.extract_pool.submit(read_file, document, mime_type=mime_type).result()
+            if text is None:
+                raise UnsupportedDocument('Unsupported document type, send a pdf, docx or text document')
+            document_type, checks = self.llm_pool.submit(classify_and_analyze, text, self.combined).result()
+            self.count(completed=1)
+        except Exception:
+            self.count(failed=1)
+            raise
+        finally:
+            self.count(in_progress=-1)
+            self.slots.release()
+        seconds = time.perf_counter() - start
+        emit('service_request', document_type=document_type, seconds=seconds)
+        return {'document_type': document_type, 'checks': checks.serializable() if checks else None,
+                'seconds': seconds}
+
+    @staticmethod
+    def combine(vso: list, ao: list) -> dict:
+        vso_checks, ao_checks = Checks(), Checks()
+        vso_checks.deserialize(json.dumps(vso))
+        ao_checks.deserialize(json.dumps(ao))
+        combined_checks, extra_advice = check_vso_with_ao(vso_checks, ao_checks)
+        return {'checks': combined_checks.serializable(),
+                'advice': generate_advice(vso_checks, combined_checks, extra_advice)}
+
+    def health(self) -> dict:
+        with self._stats_lock:
+            return dict(self.stats, queue_size=self.queue_size)
+
+    def shutdown(self):
+        self.extract_pool.shutdown()
+        self.llm_pool.shutdown()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'otis_ask'
+    worker: Worker = None  # Set by serve()
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(self.worker.health())
+        else:
+            self.send_json({'error': 'Not found'}, HTTPStatus.NOT_FOUND)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            self.send_json({'error': 'Document too large'}, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return
+        body = self.rfile.read(length)
+        try:
+            match self.path:
+                case '/analyze':
+                    mime_type = self.headers.get_content_type()
+                    result = self.worker.analyze(body, mime_type if mime_type in KNOWN_MIME_TYPES else None)
+                    if result is None:
+                        self.send_json({'error': 'Too many documents in progress'}, HTTPStatus.SERVICE_UNAVAILABLE,
+                                       {'Retry-After': str(RETRY_AFTER)})
+                        return
+                case '/combine':
+                    data = json.loads(body)
+                    result = self.worker.combine(data['vso'], data['ao'])
+                case _:
+                    self.send_json({'error': 'Not found'}, HTTPStatus.NOT_FOUND)
+                    return
+        except UnsupportedDocument as e:
+            self.send_json({'error': str(e)}, HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
+            return
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json({'error': f'{type(e).__name__}: {e}'}, HTTPStatus.BAD_REQUEST)
+            return
+        except Exception as e:
+            self.send_json({'error': f'{type(e).__name__}: {e}'}, HTTPStatus.INTERNAL_SERVER_ERROR)
+            return
+        self.send_json(result)
+
+    def send_json(self, data, status=HTTPStatus.OK, headers: dict = None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        emit('service_log', message=format % args)
+
+
+def serve(host='127.0.0.1', port=8000, worker: Worker = None) -> ThreadingHTTPServer:
+    """ Returns a warmed up server, call serve_forever() on it to start handling requests """
+    worker = worker or Worker()
+    worker.warm_up()
+    handler = type('Handler', (RequestHandler,), {'worker': worker})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run otis_ask as a long running local service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help='Documents accepted at the same time')
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS)
+    parser.add_argument('--llm-workers', type=int, default=LLM_WORKERS)
+    parser.add_argument('--combined', action='store_true', help='Classify and analyze in one LLM call')
+    args = parser.parse_args()
+
+    worker = Worker(args.queue_size, args.extract_workers, args.llm_workers, args.combined)
+    server = serve(args.host, args.port, worker)
+    print(f'Listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        worker.shutdown()
+
+
+if __name__ == '__main__':
+    main()
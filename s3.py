@@ -1,7 +1,12 @@
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache
 
 import boto3
 import requests
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 from PIL import Image
 from io import BytesIO
 
@@ -35,35 +40,83 @@ class S3ImagesUploadFailed(Exception):
     pass
 
 
+MB = 1024 * 1024
+
+
 class S3:
-    def __init__(self, bucket_name, region_name='eu-west-1'):
-        self.client = boto3.client('s3', region_name=region_name)
+    def __init__(self, bucket_name, region_name='eu-west-1', endpoint_url=None, multipart_chunksize=8 * MB,
+                 max_concurrency=10, max_workers=8):
+        """ endpoint_url points the client to another S3 compatible service, like a local stand-in for testing.
+        Objects larger than multipart_chunksize are transferred in parts of that size,
+        max_concurrency parts at a time. max_workers is the number of objects add_many and download_many
+        transfer at the same time. """
+        self.client = boto3.client('s3', region_name=region_name, endpoint_url=endpoint_url)
         self.bucket_name = bucket_name
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self.keys = None  # Key index, filled by load_key_index and kept up to date on writes and deletes
+        self._keys_lock = threading.Lock()
+        self.max_workers = max_workers
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_chunksize,
+                                              multipart_chunksize=multipart_chunksize,
+                                              max_concurrency=max_concurrency)
 
     def add(self, file_path, object_name=None):
         if not object_name:
             object_name = file_path
-        self.client.upload_file(file_path, self.bucket_name, object_name)
+        self.client.upload_file(file_path, self.bucket_name, object_name, Config=self.transfer_config)
+        self._remember(object_name)
         return self.url(object_name)
 
     def add_from_url(self, url, object_name):
-        """ Add an image from a url to the bucket, with name object_name"""
-        response = requests.get(url)
-        if response.status_code == 200:
-            self.client.put_object(Bucket=self.bucket_name, Key=object_name, Body=response.content)
-            return self.url(object_name)
-        else:
-            raise S3ImagesUploadFailed(f'Failed to get image from {url}')
+        """ Add an image from a url to the bucket, with name object_name.
+        The download is streamed into a multipart upload so the object is never completely in memory """
+        with requests.get(url, stream=True) as response:
+            if response.status_code != 200:
+                raise S3ImagesUploadFailed(f'Failed to get image from {url}')
+            response.raw.decode_content = True
+            return self.add_from_fileobj(response.raw, object_name, response.headers.get('Content-Type'))
+
+    def add_from_fileobj(self, fileobj, object_name, mime_type=None):
+        """ Upload from a binary file object, like an upload stream, in parts without reading it completely """
+        extra_args = {'ContentType': mime_type} if mime_type else None
+        self.client.upload_fileobj(fileobj, self.bucket_name, object_name, ExtraArgs=extra_args,
+                                   Config=self.transfer_config)
+        self._remember(object_name)
+        return self.url(object_name)
+
+    def add_many(self, items):
+        """ Upload many (file_path or file object, object_name) pairs in parallel. Returns the urls in order """
+        def add_one(item):
+            source, object_name = item
+            if hasattr(source, 'read'):
+                return self.add_from_fileobj(source, object_name)
+            return self.add(source, object_name)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(add_one, items))
 
     def add_from_file_data(self, data, object_name, mime_type=None):
         """ Add an image from a url to the bucket, with name object_name"""
         print('ADD FROM FILE DATA', object_name, mime_type)
         self.client.put_object(Bucket=self.bucket_name, Key=object_name, Body=data, ContentType=mime_type)
+        self._remember(object_name)
         return self.url(object_name)
 
-    def get_data(self, object_name):
-        """ Returns the content of the object as bytes"""
-        return self.client.get_object(Bucket=self.bucket_name, Key=object_name)['Body'].read()
+    def get_data(self, object_name, start=None, end=None):
+        """ Returns the content of the object as bytes. With start and/or end only that (inclusive) byte range """
+        if start is None and end is None:
+            return self.client.get_object(Bucket=self.bucket_name, Key=object_name)['Body'].read()
+        byte_range = f'bytes={start or 0}-{"" if end is None else end}'
+        return self.client.get_object(Bucket=self.bucket_name, Key=object_name, Range=byte_range)['Body'].read()
+
+    def stream(self, object_name, chunk_size=MB):
+        """ Yields the content of the object in chunks of chunk_size bytes """
+        body = self.client.get_object(Bucket=self.bucket_name, Key=object_name)['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
 
     def add_from_pil_image(self, image, object_name: str):
         def get_safe_ext(key):
@@ -84,18 +137,57 @@ class S3:
         sent_data = self.client.put_object(Bucket=self.bucket_name, Key=object_name, Body=buffer)
         if sent_data['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise S3ImagesUploadFailed('Failed to upload image {} to bucket {}'.format(object_name, self.bucket_name))
+        self._remember(object_name)
         return self.url(object_name)
 
     def download(self, object_name, file_path):
-        self.client.download_file(self.bucket_name, object_name, file_path)
+        self.client.download_file(self.bucket_name, object_name, file_path, Config=self.transfer_config)
+
+    def download_fileobj(self, object_name, fileobj):
+        """ Download into a binary file object using concurrent ranged requests for large objects """
+        self.client.download_fileobj(self.bucket_name, object_name, fileobj, Config=self.transfer_config)
+
+    def download_many(self, items):
+        """ Download many (object_name, file_path) pairs in parallel """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(lambda item: self.download(*item), items))
 
     def delete(self, object_name):
         response = self.client.delete_object(Bucket=self.bucket_name, Key=object_name)
+        with self._keys_lock:
+            if self.keys is not None:
+                self.keys.discard(object_name)
         return response
 
-    def list(self):
-        response = self.client.list_objects_v2(Bucket=self.bucket_name)
-        return [c['Key'] for c in response['Contents']]
+    def list(self, prefix=''):
+        """ Returns all keys in the bucket that start with prefix, following the pagination of list_objects_v2 """
+        paginator = self.client.get_paginator('list_objects_v2')
+        return [c['Key'] for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix)
+                for c in page.get('Contents', [])]
+
+    def load_key_index(self, prefix=''):
+        """ Fill the local key index so exists() needs no request. Writes and deletes through this object keep
+        it up to date, objects written by others are only seen after loading it again """
+        keys = set(self.list(prefix))
+        with self._keys_lock:
+            self.keys = keys
+
+    def _remember(self, object_name):
+        with self._keys_lock:
+            if self.keys is not None:
+                self.keys.add(object_name)
+
+    def exists(self, object_name):
+        """ Checks the key index when it is loaded, otherwise does a HEAD request for the object """
+        if self.keys is not None:
+            return object_name in self.keys
+        try:
+            self.head_object(object_name)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
 
     def head_object(self, object_name):
         response = self.client.head_object(Bucket=self.bucket_name, Key=object_name)
@@ -106,18 +198,40 @@ class S3:
 
     def url(self, object_name):
         """ return the public url of an object in the bucket"""
+        if self.endpoint_url:
+            return f'{self.endpoint_url.rstrip("/")}/{self.bucket_name}/{object_name}'
         return f'https://s3.{self.client.meta.region_name}.amazonaws.com/{self.bucket_name}/{object_name}'
 
     def sized(self, object_name: str, size: tuple):
         """ Returns the url of the image given by object name, resized to size
         If the sized version does not exist in the bucket, use PIL to create it."""
-        w, h = size
-        name, ext = object_name.rsplit('.', 1)
-        sized_name = f'{name}_{w}x{h}.{ext}'
-        if sized_name not in self.list():
+        sized_name = self.sized_name(object_name, size)
+        if not self.exists(sized_name):
             self.create_sized(object_name, sized_name, size)
         return self.url(sized_name)
 
+    @staticmethod
+    def sized_name(object_name: str, size: tuple):
+        w, h = size
+        name, ext = object_name.rsplit('.', 1)
+        return f'{name}_{w}x{h}.{ext}'
+
+    def create_sized_many(self, object_names: list, sizes: list, max_workers=None):
+        """ Create the missing sized versions of all object_names in all sizes, in parallel on a process pool.
+        Returns a dict (object_name, size) -> url """
+        if self.keys is None:
+            self.load_key_index()
+        jobs = [(object_name, size) for object_name in object_names for size in sizes]
+        missing = [(object_name, size) for object_name, size in jobs
+                   if self.sized_name(object_name, size) not in self.keys]
+        if missing:
+            settings = (self.bucket_name, self.region_name, self.endpoint_url)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(_create_sized_in_process, [settings] * len(missing), missing))
+            for object_name, size in missing:
+                self._remember(self.sized_name(object_name, size))
+        return {(object_name, size): self.url(self.sized_name(object_name, size)) for object_name, size in jobs}
+
     def create_sized(self, object_name: str, sized_name: str, size: tuple):
         """ Creates a sized version of object_name in the bucket, with name sized_name"""
 
@@ -127,6 +241,17 @@ class S3:
         return self.add_from_pil_image(image, sized_name)
 
 
+@cache
+def _process_s3(bucket_name, region_name, endpoint_url):
+    """ boto3 clients can't be pickled, so every worker process creates its own """
+    return S3(bucket_name, region_name, endpoint_url)
+
+
+def _create_sized_in_process(settings: tuple, job: tuple):
+    object_name, size = job
+    s3 = _process_s3(*settings)
+    return s3.create_sized(object_name, s3.sized_name(object_name, size), size)
+
 
 if __name__ == '__main__':
     s3 = S3('harmsen.nl')
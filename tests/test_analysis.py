@@ -0,0 +1,81 @@
+""" The async api: failures stay per document and blocking work stays off the event loop. And parsing the
+combined answer """
+import asyncio
+import threading
+
+import pytest
+
+from benchmarks.stub_llm import StubAgent
+from otis_ask import analysis
+from otis_ask.cache import ResponseCache, SingleFlight
+from otis_ask.checks import Checks
+from otis_ask.clients import AgentPool
+from otis_ask.prompting import create_combined_prompt
+
+VSO_TEXT = 'Partijen komen overeen dat de beëindiging per 1 maart 2024 plaatsvindt. ' * 3
+
+
+class FailingAgent(StubAgent):
+    """ Fails on documents that contain KAPOT """
+    latency = 0
+
+    def chat(self, prompt: str) -> str:
+        if 'KAPOT' in prompt:
+            raise ConnectionError('LLM down')
+        return super().chat(prompt)
+
+
+@pytest.fixture(autouse=True)
+def llm(tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis, 'agent_pool', AgentPool(factory=FailingAgent))
+    monkeypatch.setattr(analysis, 'response_cache', ResponseCache(tmp_path / 'responses.sqlite'))
+    monkeypatch.setattr(analysis, 'check_cache', ResponseCache(tmp_path / 'checks.sqlite'))
+    monkeypatch.setattr(analysis, 'flights', SingleFlight())
+
+
+@pytest.mark.parametrize('combined', [False, True])
+def test_one_failure_keeps_the_other_results(combined):
+    texts = [VSO_TEXT, 'KAPOT document', 'Een loonstrook']
+    results = asyncio.run(analysis.analyze_many_async(texts, combined=combined))
+    assert results[0][0] == 'vaststellingsovereenkomst' and len(results[0][1]) > 0
+    assert isinstance(results[1], ConnectionError)
+    assert results[2] == ('ander type', None)
+
+
+def test_check_cache_is_not_used_on_the_event_loop(monkeypatch):
+    threads = set()
+    get = analysis.check_cache.get
+
+    def recording_get(key):
+        threads.add(threading.current_thread())
+        return get(key)
+
+    monkeypatch.setattr(analysis.check_cache, 'get', recording_get)
+
+    async def analyze():
+        return threading.current_thread(), await analysis.analyze_vso_async(VSO_TEXT, None)
+
+    loop_thread, checks = asyncio.run(analyze())
+    assert len(checks) > 0
+    assert threads and loop_thread not in threads
+
+
+def combined_answer(type_line: str) -> str:
+    analysis.load_prompts()
+    prompt = create_combined_prompt(VSO_TEXT, Checks('vso_checks.toml'), Checks('ao_checks.toml'))
+    return type_line + '\n' + StubAgent.answer(prompt).split('\n', 1)[1]
+
+
+@pytest.mark.parametrize('type_line', ['TYPE vaststellingsovereenkomst.', 'TYPE: "Vaststellingsovereenkomst"'])
+def test_combined_type_with_punctuation(type_line):
+    document_type, checks = analysis.process_combined_response(combined_answer(type_line), VSO_TEXT)
+    assert document_type == 'vaststellingsovereenkomst' and len(checks) > 0
+
+
+@pytest.mark.parametrize('response', ['TYPE contract', 'TYPE een arbeidsovereenkomst', 'Vaststellingsovereenkomst', ''])
+def test_combined_unknown_type_is_malformed(response):
+    assert analysis.process_combined_response(response, VSO_TEXT) is None
+
+
+def test_combined_other_type_has_no_checks():
+    assert analysis.process_combined_response('TYPE Loonstrook.', VSO_TEXT) == ('loonstrook', None)
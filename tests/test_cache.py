@@ -0,0 +1,135 @@
+""" SingleFlight shares a computation between threads, the pending claims of ResponseCache between processes.
+Two ResponseCache objects on the same file behave like two processes sharing it. """
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from otis_ask import cache
+from otis_ask.cache import ResponseCache, SingleFlight
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_single_flight_leader_and_followers():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(8) as executor:
+        futures = [executor.submit(flights.run, 'key', compute, 21) for _ in range(8)]
+        wait_for(lambda: flights.coalesced == 7)
+        release.set()
+        assert [future.result() for future in futures] == [42] * 8
+    assert calls == [21]
+
+    assert flights.run('key', compute, 1) == 2  # Finished flights are not shared with later callers
+    assert calls == [21, 1]
+
+
+def test_single_flight_errors_reach_followers():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError('LLM error')
+
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(flights.run, 'key', fail) for _ in range(3)]
+        wait_for(lambda: flights.coalesced == 2)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError, match='LLM error'):
+                future.result()
+    assert flights.run('key', lambda: 'ok') == 'ok'
+
+
+def test_single_flight_followers_retry_when_leader_gives_up():
+    flights = SingleFlight()
+    _, leader = flights.join('key')
+    assert leader
+    with ThreadPoolExecutor(1) as executor:
+        follower = executor.submit(flights.run, 'key', lambda: 'computed by follower')
+        wait_for(lambda: flights.coalesced == 1)
+        flights.land('key')  # Gave up without a result
+        assert follower.result(timeout=5) == 'computed by follower'
+
+
+@pytest.fixture
+def caches(tmp_path):
+    path = tmp_path / 'cache.sqlite'
+    return ResponseCache(path), ResponseCache(path)
+
+
+def test_claim_makes_other_process_wait(caches):
+    first, second = caches
+    assert first.claim('key')
+    assert not second.claim('key')
+
+    def finish():
+        time.sleep(0.2)
+        first.set('key', 'response')
+        first.release('key')
+
+    threading.Thread(target=finish).start()
+    assert second.wait('key') == 'response'
+    assert second.claim('key')  # Released, so it can be claimed again
+
+
+def test_wait_returns_none_when_claim_is_released_without_value(caches):
+    first, second = caches
+    assert first.claim('key')
+    threading.Timer(0.2, first.release, ('key',)).start()
+    assert second.wait('key') is None
+    assert second.claim('key')
+
+
+def test_stale_claim_is_taken_over(caches, monkeypatch):
+    monkeypatch.setattr(cache, 'PENDING_TIMEOUT', 0.2)
+    first, second = caches
+    assert first.claim('key')  # And then the first process hangs or crashes
+    assert not second.claim('key')
+    time.sleep(0.3)
+    assert second.wait('key') is None
+    assert second.claim('key')
+    assert not first.claim('key')
+
+
+def test_claim_of_killed_process_is_taken_over_at_once(tmp_path):
+    path = tmp_path / 'cache.sqlite'
+    claim = f'from otis_ask.cache import ResponseCache; assert ResponseCache({str(path)!r}).claim("key")'
+    subprocess.run([sys.executable, '-c', claim], check=True, cwd=Path(__file__).parent.parent)
+    second = ResponseCache(path)
+    start = time.monotonic()
+    assert second.wait('key') is None
+    assert second.claim('key')
+    assert time.monotonic() - start < 1
+
+
+def test_claim_of_earlier_process_with_same_pid_is_taken_over(caches, monkeypatch):
+    first, second = caches
+    assert first.claim('key')
+    monkeypatch.setattr(cache, 'PROCESS_TOKEN', 'restarted')  # Like a restarted container, its main process has pid 1
+    assert second.claim('key')
+
+
+def test_clear_removes_claims(caches):
+    first, second = caches
+    assert first.claim('key')
+    first.clear()
+    assert second.claim('key')
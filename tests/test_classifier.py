@@ -0,0 +1,48 @@
+""" Clear-cut documents are classified locally, documents that only mention an arbeidsovereenkomst go to the LLM """
+import random
+
+import pytest
+
+from benchmarks.corpus import ao_lines, vso_lines
+from otis_ask.classifier import AO, VSO, classify_locally
+
+PAYSLIP = """Loonstrook januari 2024
+Werkgever B.V.
+Arbeidsovereenkomst: onbepaalde tijd
+Brutoloon 3.500,00
+Loonheffing 812,00
+Netto te betalen 2.688,00"""
+
+RESIGNATION = """Betreft: opzegging arbeidsovereenkomst
+
+Geachte heer Jansen,
+Hierbij zeg ik mijn arbeidsovereenkomst op met inachtneming van de opzegtermijn van een maand.
+Mijn laatste werkdag is 31 maart 2024. Ik verzoek u mijn resterende vakantiedagen uit te betalen.
+Met vriendelijke groet,
+P. de Vries"""
+
+CAO = """Collectieve Arbeidsovereenkomst voor de Metaal en Techniek 2024
+Hoofdstuk 1 Werkingssfeer
+Deze cao is van toepassing op iedere arbeidsovereenkomst. De proeftijd is ten hoogste twee maanden.
+De arbeidsduur is 38 uur per week. De werknemer heeft recht op 25 vakantiedagen."""
+
+ADDENDUM = """Addendum bij de arbeidsovereenkomst
+In aanvulling op de arbeidsovereenkomst van 1 mei 2020 spreken partijen af dat de arbeidsduur
+per 1 januari 2024 32 uur per week bedraagt. De werktijden worden in overleg vastgesteld."""
+
+
+@pytest.mark.parametrize('text', [PAYSLIP, RESIGNATION, CAO, ADDENDUM])
+def test_other_documents_go_to_the_llm(text):
+    assert classify_locally(text) is None
+
+
+def test_title_alone_is_not_enough():
+    assert classify_locally('Arbeidsovereenkomst\n\nDe arbeidsovereenkomst is getekend.') is None
+
+
+@pytest.mark.parametrize('document_type, lines', [(VSO, vso_lines), (AO, ao_lines)])
+def test_clear_documents_are_classified_locally(document_type, lines):
+    rnd = random.Random(1)
+    for number in range(20):
+        classification = classify_locally('\n'.join(lines(rnd, number)))
+        assert classification.document_type == document_type and classification.method == 'local'
@@ -0,0 +1,113 @@
+""" Identical LLM calls in progress are made once, whether they are asked with doprompt, doprompt_async or
+doprompt_stream """
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from otis_ask import analysis
+from otis_ask.cache import ResponseCache, SingleFlight
+from otis_ask.clients import AgentPool
+
+
+class SlowAgent:
+    """ Answers every prompt with its reverse, once release is set """
+    calls = []
+    release = threading.Event()
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def reset(self):
+        pass
+
+    def chat(self, prompt: str) -> str:
+        self.calls.append(prompt)
+        self.release.wait(5)
+        return prompt[::-1]
+
+
+@pytest.fixture(autouse=True)
+def llm(tmp_path, monkeypatch):
+    SlowAgent.calls = []
+    SlowAgent.release = threading.Event()
+    monkeypatch.setattr(analysis, 'agent_pool', AgentPool(factory=SlowAgent))
+    monkeypatch.setattr(analysis, 'response_cache', ResponseCache(tmp_path / 'responses.sqlite'))
+    monkeypatch.setattr(analysis, 'flights', SingleFlight())
+
+
+def wait_for_followers(count: int):
+    deadline = time.monotonic() + 5
+    while analysis.flights.coalesced < count:
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_doprompt_threads_share_one_call():
+    with ThreadPoolExecutor(8) as executor:
+        futures = [executor.submit(analysis.doprompt, 'prompt') for _ in range(8)]
+        wait_for_followers(7)
+        SlowAgent.release.set()
+        assert {future.result() for future in futures} == {'tpmorp'}
+    assert SlowAgent.calls == ['prompt']
+
+
+def test_doprompt_async_shares_one_call():
+    async def ask_all():
+        tasks = [asyncio.ensure_future(analysis.doprompt_async('prompt')) for _ in range(8)]
+        while analysis.flights.coalesced < 7:
+            await asyncio.sleep(0.01)
+        SlowAgent.release.set()
+        return await asyncio.gather(*tasks)
+
+    assert set(asyncio.run(ask_all())) == {'tpmorp'}
+    assert SlowAgent.calls == ['prompt']
+
+
+def test_streams_and_doprompt_share_one_call():
+    with ThreadPoolExecutor(4) as executor:
+        streams = [executor.submit(lambda: ''.join(analysis.doprompt_stream('prompt'))) for _ in range(2)]
+        calls = [executor.submit(analysis.doprompt, 'prompt') for _ in range(2)]
+        wait_for_followers(3)
+        SlowAgent.release.set()
+        assert {future.result() for future in streams + calls} == {'tpmorp'}
+    assert SlowAgent.calls == ['prompt']
+    assert list(analysis.doprompt_stream('prompt')) == ['tpmorp']  # From the cache
+
+
+def test_stream_errors_reach_followers(monkeypatch):
+    def fail(self, prompt):
+        self.release.wait(5)
+        raise ConnectionError('LLM down')
+
+    monkeypatch.setattr(SlowAgent, 'chat', fail)
+    with ThreadPoolExecutor(2) as executor:
+        stream = executor.submit(lambda: list(analysis.doprompt_stream('prompt')))
+        call = executor.submit(analysis.doprompt, 'prompt')
+        wait_for_followers(1)
+        SlowAgent.release.set()
+        for future in (stream, call):
+            with pytest.raises(ConnectionError):
+                future.result()
+
+
+def test_followers_ask_again_when_stream_is_abandoned(monkeypatch):
+    def stream_chat(agent, prompt):
+        agent.calls.append(prompt)
+        yield 'first chunk'
+        agent.release.wait(5)
+        yield 'second chunk'
+
+    monkeypatch.setattr(analysis, 'stream_chat', stream_chat)
+    stream = analysis.doprompt_stream('prompt')
+    assert next(stream) == 'first chunk'
+    with ThreadPoolExecutor(1) as executor:
+        call = executor.submit(analysis.doprompt, 'prompt')
+        wait_for_followers(1)
+        stream.close()  # Stops reading before the response is complete, so doprompt has to ask itself
+        SlowAgent.release.set()
+        assert call.result(timeout=5) == 'tpmorp'
+    assert SlowAgent.calls == ['prompt', 'prompt']
+    assert analysis.doprompt('prompt') == 'tpmorp'  # The incomplete streamed response was not cached
@@ -0,0 +1,81 @@
+""" Which pdf pages are OCR'd, and what is cached when their OCR fails. OCR itself is replaced, it needs poppler
+and tesseract """
+import pytest
+from pypdf import PdfWriter
+
+from benchmarks.corpus import LINES_PER_PAGE, write_scanned_pdf, write_text_pdf
+from otis_ask import documentreader
+from otis_ask.cache import ResponseCache
+from otis_ask.documentreader import OCRFailed, read_file
+
+TEXT = ['Dit is een vaststellingsovereenkomst met genoeg tekst op iedere pagina'] * 5
+
+
+@pytest.fixture(autouse=True)
+def extraction_cache(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path / 'extraction.sqlite', max_entries=None)
+    monkeypatch.setattr(documentreader, 'extraction_cache', cache)
+    return cache
+
+
+@pytest.fixture
+def ocr(monkeypatch):
+    """ Records the OCR'd pages. Set ocr.error to make the OCR fail """
+    class FakeOCR:
+        pages = []
+        error = None
+
+        def __call__(self, file_path, pages, poppler_path=None, timings=None):
+            self.pages += pages
+            return [self.error or f'gescande pagina {page}' for page in pages]
+
+    fake = FakeOCR()
+    monkeypatch.setattr(documentreader, 'ocr_pdf', fake)
+    return fake
+
+
+def test_blank_page_of_text_pdf_is_not_ocrd(tmp_path, ocr):
+    write_text_pdf(tmp_path / 'text.pdf', TEXT)
+    writer = PdfWriter()
+    writer.append(str(tmp_path / 'text.pdf'))
+    writer.add_blank_page()
+    writer.write(tmp_path / 'blank_page.pdf')
+    assert read_file(str(tmp_path / 'blank_page.pdf')).startswith(TEXT[0])
+    assert ocr.pages == []
+
+
+def test_scanned_pages_are_ocrd_and_cached(tmp_path, ocr, extraction_cache):
+    write_scanned_pdf(tmp_path / 'scanned.pdf', ['regel'] * 2 * LINES_PER_PAGE)
+    assert read_file(str(tmp_path / 'scanned.pdf')) == 'gescande pagina 1\ngescande pagina 2'
+    assert len(extraction_cache) == 1
+
+
+def test_failed_ocr_of_scanned_page_raises_and_is_not_cached(tmp_path, ocr, extraction_cache):
+    write_scanned_pdf(tmp_path / 'scanned.pdf', ['regel'] * 10)
+    ocr.error = RuntimeError('poppler is not installed')
+    for _ in range(2):
+        with pytest.raises(OCRFailed):
+            read_file(str(tmp_path / 'scanned.pdf'))
+    assert len(extraction_cache) == 0
+
+    ocr.error = None  # OCR works again, so the document is read again
+    assert read_file(str(tmp_path / 'scanned.pdf')) == 'gescande pagina 1'
+
+
+def test_failed_ocr_keeps_text_layer_without_caching(tmp_path, ocr, extraction_cache, monkeypatch):
+    monkeypatch.setattr(documentreader, 'read_pdf_page_layers', lambda source: [('Korte tekst', True)])
+    ocr.error = RuntimeError('tesseract is not installed')
+    (tmp_path / 'any.pdf').write_bytes(b'%PDF-1.4')
+    timings = {}
+    assert read_file(str(tmp_path / 'any.pdf'), timings=timings) == 'Korte tekst'
+    assert timings['ocr_failed_pages'] == 1
+    assert len(extraction_cache) == 0
+
+
+def test_text_pdf_does_not_start_ocr_pool(tmp_path, monkeypatch):
+    def ocr_executor():
+        raise AssertionError('OCR pool started')
+
+    monkeypatch.setattr(documentreader, 'ocr_executor', ocr_executor)
+    write_text_pdf(tmp_path / 'text.pdf', TEXT)
+    assert read_file(str(tmp_path / 'text.pdf')).startswith(TEXT[0])
@@ -0,0 +1,122 @@
+""" The rules in combined_rules.toml must give the same results as the hand written check_vso_with_ao they replaced.
+reference_check_vso_with_ao below is that function, the rules engine is compared with it on random dossiers. """
+import random
+
+import pytest
+from justai import get_prompt
+from justdays import Day
+
+from otis_ask.analysis import load_prompts
+from otis_ask.checks import Check, Checks
+from otis_ask.rules import evaluate
+
+DOSSIERS = 3000
+
+
+def reference_check_vso_with_ao(vso_checks: Checks, ao_checks: Checks) -> tuple[Checks, str]:
+    extra_checks = Checks()
+    extra_advice = ''
+
+    def try_to_make_day_type(value):
+        try:
+            return Day(value)
+        except:  # noqa: E722, like the original
+            return value
+
+    datum_ondertekening = try_to_make_day_type(vso_checks.get('DATUM_ONDERTEKENING').value)
+    einddatum = try_to_make_day_type(vso_checks.get('EINDDATUM').value)
+    startdatum = try_to_make_day_type(ao_checks.get('STARTDATUM').value)
+
+    opzegtermijn_str = ''
+    if type(datum_ondertekening) == type(einddatum) == type(startdatum) == Day:
+        opzegdatum = datum_ondertekening.last_day_of_month() + 1
+        years = (einddatum - startdatum) / 365.25
+        opzegtermijn = 4 if years > 15 else 3 if years > 10 else 2 if years > 5 else 1
+        opzegtermijn_str = f'minimaal {opzegtermijn} maanden'
+        passed = einddatum >= opzegdatum.plus_months(opzegtermijn)
+        if not passed:
+            extra_advice += get_prompt('TERMINATION_TERM_DETAILS', opzegtermijn=opzegtermijn)
+    else:
+        passed = False
+        extra_advice += get_prompt('DATES_MISSING')
+    extra_checks.add(Check('OPZEGTERMIJN', 'Opzegtermijn', '', Day, [], True, passed, opzegtermijn_str))
+
+    for check_id, description, vso_value, texts, advice in [
+            ('RELATIEBEDING', 'Relatiebeding', 'nee', ('Vervallen', 'Niet vervallen'), 'RELATIEBEDING_NIET_VERVALLEN'),
+            ('CONCURRENTIEBEDING', 'Concurrentiebeding', 'nee', ('Vervallen', 'Niet vervallen'),
+             'CONCURRENTIEBEDING_NIET_VERVALLEN'),
+            ('PENSIOENREGELING', 'Voortzetten van pensioenregeling', 'ja', ('Voortgezet', 'Niet voortgezet'),
+             'PENSIOEN_VOORTZETTEN')]:
+        passed = True
+        if ao_checks.get(check_id).value == 'ja':
+            if vso_checks.get(check_id).value != vso_value:
+                passed = False
+                text = texts[1]
+                extra_advice += get_prompt(advice)
+            else:
+                text = texts[0]
+        else:
+            text = 'Geen'
+        result_id = 'RELATEBEDING' if check_id == 'RELATIEBEDING' else check_id  # The original id has this typo
+        extra_checks.add(Check(result_id, description, '', str, [], True, passed, text))
+
+    return extra_checks, extra_advice
+
+
+def date_value(rnd: random.Random):
+    """ Mostly valid dates, as Day or as string like from the frontend, sometimes invalid or missing ones """
+    day = Day(2000, 1, 1).plus_days(rnd.randint(-3000, 9000))
+    r = rnd.random()
+    if r < 0.5:
+        return day
+    if r < 0.7:
+        return str(day)
+    if r < 0.75:
+        return f'{day.y}-{day.m}-{day.d}'
+    return rnd.choice(['', 'nee', 'onbekend', '2024-13-01', '2024-02-30', None])
+
+
+def random_dossier(rnd: random.Random) -> tuple[Checks, Checks]:
+    vso_checks, ao_checks = Checks('vso_checks.toml'), Checks('ao_checks.toml')
+    for check in vso_checks.checks + ao_checks.checks:
+        check.value = rnd.choice(['ja', 'nee', '', 'Ja', 'misschien'])
+    vso_checks.get('DATUM_ONDERTEKENING').value = date_value(rnd)
+    vso_checks.get('EINDDATUM').value = date_value(rnd)
+    ao_checks.get('STARTDATUM').value = date_value(rnd)
+    if rnd.random() < 0.2:  # Around the limits of the years of service and at the end of a month
+        start = Day(2000, 1, 31)
+        ao_checks.get('STARTDATUM').value = start
+        vso_checks.get('EINDDATUM').value = start.plus_days(round(rnd.choice([5, 10, 15]) * 365.25)
+                                                            + rnd.choice([-1, 0, 1]))
+        vso_checks.get('DATUM_ONDERTEKENING').value = start.plus_days(rnd.randint(0, 9000))
+    return vso_checks, ao_checks
+
+
+@pytest.fixture(scope='module', autouse=True)
+def prompts():
+    load_prompts()
+
+
+def test_rules_match_reference():
+    rnd = random.Random(1)
+    pairs = [random_dossier(rnd) for _ in range(DOSSIERS)]
+    for (vso_checks, ao_checks), (combined_checks, advice) in zip(pairs, evaluate(pairs)):
+        expected_checks, expected_advice = reference_check_vso_with_ao(vso_checks, ao_checks)
+        assert combined_checks.checks == expected_checks.checks
+        assert [type(check.passed) for check in combined_checks] == [type(check.passed) for check in expected_checks]
+        assert advice == expected_advice
+
+
+def test_rules_cover_every_outcome():
+    """ The random dossiers must reach every branch, otherwise the comparison proves little """
+    rnd = random.Random(1)
+    outcomes = set()
+    for combined_checks, _ in evaluate([random_dossier(rnd) for _ in range(DOSSIERS)]):
+        outcomes.update((check.id, check.passed, check.value) for check in combined_checks)
+    for months in range(1, 5):
+        assert ('OPZEGTERMIJN', True, f'minimaal {months} maanden') in outcomes
+        assert ('OPZEGTERMIJN', False, f'minimaal {months} maanden') in outcomes
+    assert ('OPZEGTERMIJN', False, '') in outcomes
+    for check_id, texts in [('RELATEBEDING', ['Geen', 'Vervallen', 'Niet vervallen']),
+                            ('PENSIOENREGELING', ['Geen', 'Voortgezet', 'Niet voortgezet'])]:
+        assert {value for id, _, value in outcomes if id == check_id} == set(texts)
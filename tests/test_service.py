@@ -0,0 +1,69 @@
+""" Documents without text are refused, by the service with 415 and by the batch pipeline per document, instead of
+being classified by the LLM """
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.stub_llm import StubAgent
+from otis_ask import analysis, service
+from otis_ask.batch import BatchPipeline, LocalStore
+from otis_ask.cache import ResponseCache, SingleFlight
+from otis_ask.clients import AgentPool
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(64)
+VSO_TEXT = 'Partijen komen overeen dat de beëindiging per 1 maart 2024 plaatsvindt. ' * 3
+
+
+class CountingAgent(StubAgent):
+    latency = 0
+    prompts = []
+
+    def chat(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return super().chat(prompt)
+
+
+@pytest.fixture(autouse=True)
+def llm(tmp_path, monkeypatch):
+    CountingAgent.prompts = []
+    pool = AgentPool(factory=CountingAgent)
+    monkeypatch.setattr(analysis, 'agent_pool', pool)
+    monkeypatch.setattr(service, 'agent_pool', pool)
+    monkeypatch.setattr(analysis, 'response_cache', ResponseCache(tmp_path / 'responses.sqlite'))
+    monkeypatch.setattr(analysis, 'check_cache', ResponseCache(tmp_path / 'checks.sqlite'))
+    monkeypatch.setattr(analysis, 'flights', SingleFlight())
+
+
+def test_service_refuses_image_with_415():
+    server = service.serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        request = urllib.request.Request(f'http://127.0.0.1:{server.server_port}/analyze', data=PNG,
+                                         headers={'Content-Type': 'image/png'})
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request)
+        assert error.value.code == 415
+        assert 'error' in json.loads(error.value.read())
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert CountingAgent.prompts == []
+
+
+def test_batch_records_image_as_failed_document(tmp_path):
+    source = tmp_path / 'source' / 'dossier'
+    source.mkdir(parents=True)
+    (source / 'vso.txt').write_text(VSO_TEXT)
+    (source / 'scan.png').write_bytes(PNG)
+    pipeline = BatchPipeline(LocalStore(tmp_path / 'source'), LocalStore(tmp_path / 'output'),
+                             tmp_path / 'checkpoint.jsonl')
+    stats = pipeline.run()
+    assert stats['dossiers'] == 1 and stats['failed_documents'] == 1
+    result = json.loads((tmp_path / 'output' / 'dossier.json').read_text())
+    documents = {document['key']: document for document in result['documents']}
+    assert documents['dossier/scan.png']['document_type'] is None
+    assert documents['dossier/vso.txt']['document_type'] == 'vaststellingsovereenkomst'
+    assert all('PNG' not in prompt for prompt in CountingAgent.prompts)